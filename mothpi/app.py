@@ -8,18 +8,42 @@ Run a web app to configure a mothpy instance.
 
 2021, Technische Universität München, Ludwig Kürzinger
 """
+
 import logging
-from flask import Flask, render_template, flash, redirect
+from flask import Flask, Response, render_template, flash, redirect
+from flask import jsonify, request
 from flask_bootstrap import Bootstrap
 from flask_wtf import FlaskForm
 from wtforms import BooleanField, SubmitField, IntegerField, FloatField, StringField
 from flask_nav import Nav
 from flask_nav.elements import Navbar, View
 import base64
+import gzip
+import time
 import uuid
 
 # Mothpi imports
 from mothpi.config import config
+from mothpi.metrics import metrics
+from mothpi.logbuffer import log_buffer
+from mothpi.history import StatusHistory
+
+# Responses of these types are compressed if the client accepts gzip
+GZIP_MIMETYPES = ["text/html", "application/json", "text/plain"]
+GZIP_MIN_SIZE = 500
+
+# The configuration form class, rebuilt after configuration changes
+_config_form = None
+
+# Charts on the history page: (field, label)
+HISTORY_CHARTS = [
+    ("num_free_space", "Free picture slots"),
+    ("num_pics", "Stored pictures"),
+    ("cameras_available", "Cameras available"),
+    ("temperature", "Temperature (°C)"),
+    ("wind_speed", "Wind speed"),
+    ("relais", "Relais (bitmask)"),
+]
 
 
 def get_corresponding_field(key, value, description=None):
@@ -40,17 +64,93 @@ def get_corresponding_field(key, value, description=None):
     return field(**kwargs)
 
 
-def create_app():
+def get_config_form():
+    """Return the configuration form class and the list of its keys.
+
+    The class is built once from the configuration, and rebuilt
+    only after the configuration was changed.
+    """
+    global _config_form
+    if _config_form is None:
+
+        class ConfigForm(FlaskForm):
+            submit_button = SubmitField("Save Changes to Configuration")
+
+        keys = []
+        for key, value, description in config.get_descriptive_list():
+            setattr(
+                ConfigForm,
+                key,
+                get_corresponding_field(key, value, description=description),
+            )
+            keys.append(key)
+        _config_form = (ConfigForm, keys)
+    return _config_form
+
+
+def invalidate_config_form(changed=None):
+    """Discard the cached form class (called on configuration changes)."""
+    global _config_form
+    _config_form = None
+
+
+config.add_change_listener(invalidate_config_form)
+
+
+def compress_response(response):
+    """Compress HTML, JSON and text responses with gzip, if accepted."""
+    accepts_gzip = "gzip" in request.headers.get("Accept-Encoding", "").lower()
+    if (
+        not accepts_gzip
+        or response.direct_passthrough
+        or response.mimetype not in GZIP_MIMETYPES
+        or "Content-Encoding" in response.headers
+        or not 200 <= response.status_code < 300
+    ):
+        return response
+    data = response.get_data()
+    if len(data) < GZIP_MIN_SIZE:
+        return response
+    response.set_data(gzip.compress(data, compresslevel=6))
+    response.headers["Content-Encoding"] = "gzip"
+    response.headers["Content-Length"] = len(response.get_data())
+    response.vary.add("Accept-Encoding")
+    return response
+
+
+def get_history(hours=12, num_points=200):
+    """Read the downsampled status history of the last hours."""
+    history = StatusHistory(config.history_file, config.history_size, mode="r")
+    return history.downsample(start=time.time() - hours * 3600, num_points=num_points)
+
+
+def get_chart_points(times, values, width=600, height=100):
+    """Scale values to SVG polyline points "x,y x,y ..."."""
+    if not values:
+        return ""
+    t0, t1 = min(times), max(times)
+    v0, v1 = min(values), max(values)
+    points = []
+    for t, v in zip(times, values):
+        x = (t - t0) / (t1 - t0) * width if t1 > t0 else 0
+        y = height - ((v - v0) / (v1 - v0) * height if v1 > v0 else height / 2)
+        points.append(f"{x:.1f},{y:.1f}")
+    return " ".join(points)
+
+
+def create_app(mothpi=None):
     """Create the Flask app.
 
     Note that the app may be started either from `mothpi/app.py`
-    or from `mothpi/main.py`.
+    or from `mothpi/main.py`; only the latter passes the running
+    MothPi instance, whose health is then served as /status.json.
     """
     app = Flask(__name__)
     logging.info("Started flask server")
     secret_token = uuid.uuid4().hex
     app.config["SECRET_KEY"] = secret_token
     logging.info(f"Secret app token: {secret_token}")
+    app.after_request(compress_response)
 
     # Navigation
     nav = Nav()
@@ -61,6 +161,7 @@ def create_app():
             "Mothpi Web App",
             View("Main", ".index"),
             View("Configuration", ".configuration_page"),
+            View("History", ".history_page"),
         )
 
     # Shows a long signup form, demonstrating form rendering.
@@ -68,11 +169,11 @@ def create_app():
     def index():
         """Main page."""
         # Status image
-        status_image = (
-            "/home/kue/pics/epaper_display.png"  # config.get_status_img_path()
-        )
-        with open(status_image, "rb") as f:
-            status_image = f.read()
+        try:
+            with open(config.get_status_img_path(), "rb") as f:
+                status_image = f.read()
+        except OSError:
+            status_image = b""
         status_image = "data:image/png;base64," + base64.b64encode(status_image).decode(
             "utf-8"
         )
@@ -87,23 +188,11 @@ def create_app():
     @app.route("/config", methods=("GET", "POST"))
     def configuration_page():
         """Configuration page."""
-        # Config form with dynamic fields
-        class ConfigForm(FlaskForm):
-            submit_button = SubmitField("Save Changes to Configuration")
-
-        for key, value, description in config.get_descriptive_list():
-            setattr(
-                ConfigForm,
-                key,
-                get_corresponding_field(key, value, description=description),
-            )
-        change_dict = {key: value for key, value, _ in config.get_descriptive_list()}
+        # Config form with dynamic fields (cached)
+        ConfigForm, keys = get_config_form()
         form = ConfigForm()
         if form.validate_on_submit():
-            for item in change_dict:
-                x = getattr(form, item)
-                change_dict[item] = x.data
-                print(f"{item}={x.data}")
+            change_dict = {key: getattr(form, key).data for key in keys}
             success = config.update_from_dict(change_dict)
             config.save_config()
             if success:
@@ -113,6 +202,57 @@ def create_app():
             return redirect("/config")
         return render_template("config.html", form=form)
 
+    @app.route("/metrics")
+    def metrics_page():
+        """Metrics in the Prometheus text format."""
+        return Response(
+            metrics.render_prometheus(), mimetype="text/plain; version=0.0.4"
+        )
+
+    @app.route("/status.json")
+    def status_data():
+        """Health summary of this unit, polled by mothpi/fleet.py."""
+        if mothpi is None:
+            return jsonify(error="Mothpi is not running in this process"), 503
+        return jsonify(mothpi.health_summary())
+
+    @app.route("/history.json")
+    def history_data():
+        """Downsampled status history, ?hours=12&points=200."""
+        hours = min(24 * 31, max(1, request.args.get("hours", 12, type=int)))
+        points = min(2000, max(2, request.args.get("points", 200, type=int)))
+        return jsonify(get_history(hours, points))
+
+    @app.route("/history")
+    def history_page():
+        """Charts of the status history."""
+        hours = min(24 * 31, max(1, request.args.get("hours", 12, type=int)))
+        history = get_history(hours)
+        charts = [
+            {
+                "label": label,
+                "min": min(history[field], default=0),
+                "max": max(history[field], default=0),
+                "points": get_chart_points(history["time"], history[field]),
+            }
+            for field, label in HISTORY_CHARTS
+        ]
+        return render_template("history.html", charts=charts, hours=hours)
+
+    @app.route("/logs")
+    def logs_page():
+        """Recent log messages, newest first.
+
+        Query parameters: page, per_page, level (e.g., ?level=WARNING).
+        """
+        page = max(1, request.args.get("page", 1, type=int))
+        per_page = min(500, max(1, request.args.get("per_page", 100, type=int)))
+        level = logging.getLevelName(request.args.get("level", "NOTSET").upper())
+        if not isinstance(level, int):
+            level = logging.NOTSET
+        records, num_pages = log_buffer.get_records(page, per_page, min_level=level)
+        return jsonify(page=page, num_pages=num_pages, records=records)
+
     nav.init_app(app)
     Bootstrap(app)
     return app
@@ -0,0 +1,230 @@
+# !/usr/bin/python3
+# -*- coding:utf-8 -*-
+
+"""
+Mothpi offline benchmark.
+
+Drives Mothpi with simulated camera, GPIO and e-paper backends through
+a number of nights, and measures capture throughput, status poll latency
+and memory growth. Runs on a normal Linux computer:
+
+    python3 -m mothpi.benchmark --nights 3 --output bench.json
+
+With --baseline, the results are compared to an earlier run, and the
+program exits with an error on regressions.
+
+--
+2021, Technische Universität München, Ludwig Kürzinger
+"""
+
+import os
+
+# The simulated backends must be selected before mothpi modules are imported
+os.environ["MOTHPI_SIMULATE"] = "1"
+
+import argparse
+import json
+import logging
+import resource
+import statistics
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+from mothpi.config import config
+from mothpi.metrics import metrics
+from mothpi.simulation import simulation
+
+# Results compared against the baseline (lower is better)
+REGRESSION_KEYS = ["take_pictures_p95", "poll_status_p95", "memory_growth_kib"]
+
+
+def get_parser():
+    """Obtain an argument-parser for the script interface."""
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("--nights", type=int, default=2, help="Simulated nights")
+    parser.add_argument(
+        "--captures", type=int, default=20, help="Captures per simulated night"
+    )
+    parser.add_argument(
+        "--polls", type=int, default=2, help="Status polls per capture interval"
+    )
+    parser.add_argument("--cameras", type=int, default=1, help="Simulated cameras")
+    parser.add_argument(
+        "--picture_size",
+        type=lambda x: tuple(int(i) for i in x.split("x")),
+        default=(1500, 1000),
+        help="Picture size in pixels, WxH",
+    )
+    parser.add_argument(
+        "--capture_latency", type=float, default=0.05, help="Capture latency (s)"
+    )
+    parser.add_argument(
+        "--download_latency",
+        type=float,
+        default=0.05,
+        help="Download latency per MB (s)",
+    )
+    parser.add_argument(
+        "--failure_rate",
+        type=float,
+        default=0.0,
+        help="Probability of failing camera calls",
+    )
+    parser.add_argument(
+        "--worker",
+        dest="worker",
+        action=argparse.BooleanOptionalAction,
+        default=True,
+        help="Run the camera in a worker process",
+    )
+    parser.add_argument("--output", type=Path, help="Write results to a JSON file")
+    parser.add_argument(
+        "--baseline", type=Path, help="Compare with results of an earlier run"
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.25,
+        help="Allowed relative deterioration against the baseline",
+    )
+    parser.add_argument(
+        "--log_level",
+        type=lambda x: x.upper(),
+        default="WARNING",
+        choices=("CRITICAL", "ERROR", "WARNING", "INFO", "DEBUG", "NOTSET"),
+        help="The verbosity level of logging",
+    )
+    return parser
+
+
+def percentile(values, q):
+    """Return the q-th percentile (0..100) of a list of values."""
+    if not values:
+        return None
+    values = sorted(values)
+    index = min(len(values) - 1, round(q / 100 * (len(values) - 1)))
+    return values[index]
+
+
+def get_pictures_saved():
+    """Number of saved pictures (including those of the camera worker)."""
+    # pictures taken in the same second overwrite each other, so count
+    # the saved pictures instead of files
+    return metrics.summary().get("pictures_saved_total", 0)
+
+
+def timed_call(function, durations):
+    start = time.perf_counter()
+    function()
+    durations.append(time.perf_counter() - start)
+
+
+def run_benchmark(args):
+    """Run the simulated nights and return a dict of results."""
+    simulation.num_cameras = args.cameras
+    simulation.picture_size = args.picture_size
+    simulation.capture_latency = args.capture_latency
+    simulation.download_latency_per_mb = args.download_latency
+    simulation.failure_rate = args.failure_rate
+    pictures_folder = tempfile.mkdtemp(prefix="mothpi-benchmark-")
+    config.pictures_save_folder = pictures_folder
+    config.history_file = str(Path(tempfile.mkdtemp()) / "history.npy")
+    config.camera_worker_process = args.worker
+    config.power_save_daylight = False
+    config.power_save_weather = False
+    config.daily_reboot = False
+    # simulated time: reconnect failing cameras without backoff
+    config.cam_health_interval = 0
+
+    from mothpi.mp import MothPi
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    mothpi = MothPi()
+    # no network access during benchmarks
+    mothpi.weather.get_weather_dict = lambda *args, **kwargs: {}
+    mothpi.start_up()
+    startup_time = time.perf_counter() - start
+
+    capture_durations, poll_durations, memory = [], [], []
+    pictures_before = get_pictures_saved()
+    start = time.perf_counter()
+    for night in range(args.nights):
+        for _ in range(args.captures):
+            timed_call(mothpi.take_pictures, capture_durations)
+            for _ in range(args.polls):
+                timed_call(mothpi.poll_status, poll_durations)
+            mothpi.check_camera_health()
+        # "upload" the pictures of the night
+        for picture in Path(pictures_folder).glob("*.jpg"):
+            picture.unlink()
+        memory.append(tracemalloc.get_traced_memory()[0])
+        logging.info(f"Night {night + 1}: {memory[-1] / 1024:.0f} KiB traced")
+    total_time = time.perf_counter() - start
+    pictures = get_pictures_saved() - pictures_before
+    mothpi.stop_service()
+    tracemalloc.stop()
+
+    return {
+        "nights": args.nights,
+        "cameras": args.cameras,
+        "worker": args.worker,
+        "startup_time": round(startup_time, 3),
+        "pictures": pictures,
+        "pictures_per_second": round(pictures / total_time, 3),
+        "take_pictures_p50": round(percentile(capture_durations, 50), 4),
+        "take_pictures_p95": round(percentile(capture_durations, 95), 4),
+        "poll_status_p50": round(percentile(poll_durations, 50), 4),
+        "poll_status_p95": round(percentile(poll_durations, 95), 4),
+        "poll_status_mean": round(statistics.mean(poll_durations), 4),
+        # growth between the first and the last night
+        "memory_growth_kib": round((memory[-1] - memory[0]) / 1024, 1),
+        "max_rss_kib": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+
+def compare_with_baseline(results, baseline, tolerance):
+    """Return a list of regressions against the baseline results."""
+    regressions = []
+    for key in REGRESSION_KEYS:
+        if key not in baseline:
+            continue
+        # small absolute slack for values that are close to zero
+        limit = baseline[key] * (1 + tolerance) + 0.001
+        if key == "memory_growth_kib":
+            limit = max(limit, baseline[key] + 64)
+        if results[key] > limit:
+            regressions.append(f"{key}: {results[key]} > {limit:.4f}")
+    return regressions
+
+
+def main():
+    """Run the benchmark, print and optionally store and compare results."""
+    args = get_parser().parse_args()
+    logging.basicConfig(
+        level=args.log_level,
+        format="(%(module)s:%(lineno)d) %(levelname)s: %(message)s",
+    )
+    results = run_benchmark(args)
+    for key, value in results.items():
+        print(f"{key:>22}: {value}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+        regressions = compare_with_baseline(results, baseline, args.tolerance)
+        for regression in regressions:
+            print(f"Regression: {regression}")
+        if regressions:
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+# !/usr/bin/python3
+# -*- coding:utf-8 -*-
+
+"""
+Hardware command bus for Mothpi.
+
+Each hardware resource (camera, relais, display) is owned by a single
+worker thread that executes commands one after another, so that timers,
+button handlers and the web app never access a device concurrently.
+Commands carry a priority (lower value runs first), redundant queued
+commands can be coalesced, and the latency of each command is recorded.
+
+2021, Technische Universität München, Ludwig Kürzinger
+"""
+
+import itertools
+import logging
+import time
+from concurrent.futures import Future
+from queue import PriorityQueue
+from threading import Lock, Thread, current_thread
+
+# Command priorities, lower values are executed first
+PRIORITY_CAPTURE = 0
+PRIORITY_RELAIS = 1
+PRIORITY_DOWNLOAD = 2
+PRIORITY_BUTTON = 3
+PRIORITY_MAINTENANCE = 5
+PRIORITY_STATUS = 8
+
+_STOP = "stop"
+
+
+class LatencyStats:
+    """Per-command statistics of waiting time in the queue and run time."""
+
+    def __init__(self):
+        self._lock = Lock()
+        self.commands = {}
+
+    def record(self, command, wait_time, run_time):
+        with self._lock:
+            stats = self.commands.setdefault(
+                command, {"count": 0, "wait_max": 0.0, "run_total": 0.0, "run_max": 0.0}
+            )
+            stats["count"] += 1
+            stats["wait_max"] = max(stats["wait_max"], wait_time)
+            stats["run_total"] += run_time
+            stats["run_max"] = max(stats["run_max"], run_time)
+            stats["run_last"] = run_time
+
+    def as_dict(self):
+        """Return {command: {count, wait_max, run_avg, run_max, run_last}} in s."""
+        with self._lock:
+            return {
+                command: {
+                    "count": stats["count"],
+                    "wait_max": round(stats["wait_max"], 3),
+                    "run_avg": round(stats["run_total"] / stats["count"], 3),
+                    "run_max": round(stats["run_max"], 3),
+                    "run_last": round(stats["run_last"], 3),
+                }
+                for command, stats in self.commands.items()
+            }
+
+
+class ResourceWorker(Thread):
+    """The thread that owns one hardware resource."""
+
+    def __init__(self, resource, stats: LatencyStats):
+        super().__init__(name=f"mothpi-{resource}", daemon=True)
+        self.resource = resource
+        self.stats = stats
+        self.queue = PriorityQueue()
+        self._pending = {}
+        self._lock = Lock()
+        self._counter = itertools.count()
+
+    def submit(
+        self, command, function, args=(), kwargs=None, priority=0, coalesce=False
+    ):
+        """Queue a command; return a Future for its result.
+
+        If coalesce is set and the same command is still waiting in the
+        queue, no new command is queued and its Future is returned.
+        """
+        with self._lock:
+            if coalesce and command in self._pending:
+                return self._pending[command][-1]
+            future = Future()
+            item = (
+                priority,
+                next(self._counter),
+                command,
+                function,
+                args,
+                kwargs or {},
+                time.monotonic(),
+                future,
+            )
+            if coalesce:
+                self._pending[command] = item
+            self.queue.put(item)
+        return future
+
+    def stop(self):
+        """Stop after the queued commands (stop has the lowest priority)."""
+        self.queue.put(
+            (float("inf"), next(self._counter), _STOP, None, (), {}, 0, None)
+        )
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            _, _, command, function, args, kwargs, queued_at, future = item
+            if future is None:
+                break
+            with self._lock:
+                if self._pending.get(command) is item:
+                    del self._pending[command]
+            if not future.set_running_or_notify_cancel():
+                continue
+            start = time.monotonic()
+            try:
+                future.set_result(function(*args, **kwargs))
+            except BaseException as e:
+                logging.error(f"{self.resource}: command {command} failed: {e!r}")
+                future.set_exception(e)
+            end = time.monotonic()
+            self.stats.record(
+                f"{self.resource}.{command}", start - queued_at, end - start
+            )
+
+
+class HardwareBus:
+    """Serialize hardware access by routing commands to resource workers.
+
+    Example:
+    >> bus = HardwareBus(["camera", "relais", "display"])
+    >> bus.call("camera", "capture", camera.capture, priority=PRIORITY_CAPTURE)
+    """
+
+    def __init__(self, resources):
+        self.stats = LatencyStats()
+        self.workers = {name: ResourceWorker(name, self.stats) for name in resources}
+        for worker in self.workers.values():
+            worker.start()
+
+    def submit(
+        self, resource, command, function, *args, priority=0, coalesce=False, **kwargs
+    ):
+        """Queue a command for the worker of a resource; return a Future."""
+        return self.workers[resource].submit(
+            command, function, args, kwargs, priority=priority, coalesce=coalesce
+        )
+
+    def call(
+        self, resource, command, function, *args, priority=0, coalesce=False, **kwargs
+    ):
+        """Execute a command on the worker of a resource and wait for the result.
+
+        If called from the worker thread itself, the function is executed
+        directly to avoid a deadlock.
+        """
+        if current_thread() is self.workers[resource]:
+            return function(*args, **kwargs)
+        future = self.submit(
+            resource,
+            command,
+            function,
+            *args,
+            priority=priority,
+            coalesce=coalesce,
+            **kwargs,
+        )
+        return future.result()
+
+    def latency(self):
+        """Return the latency statistics of all commands."""
+        return self.stats.as_dict()
+
+    def stop(self):
+        """Stop all workers after their queued commands."""
+        for worker in self.workers.values():
+            worker.stop()
@@ -10,8 +10,19 @@ This interface may change if the camera is changed.
 """
 
 import logging
+import statistics
+import time
+from collections import namedtuple
+from threading import RLock
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-import gphoto2 as gp
+from mothpi.metrics import metrics
+from mothpi.simulation import SIMULATE
+
+if SIMULATE:
+    from mothpi.simulation import gphoto2 as gp
+else:
+    import gphoto2 as gp
 import os
 import datetime
 
@@ -23,35 +34,179 @@ import datetime
 # https://github.com/jim-easterbrook/python-gphoto2
 
 
+def detect_cameras():
+    """Enumerate connected cameras via the gphoto2 port list.
+
+    Returns a list of (model, port) tuples, sorted by port.
+    """
+    try:
+        detected = [(name, port) for name, port in gp.Camera.autodetect()]
+    except gp.GPhoto2Error as e:
+        logging.error(f"Camera autodetection failed: {e}")
+        detected = []
+    return sorted(detected, key=lambda item: item[1])
+
+
+# Names of the camera clock widget, first found wins
+CLOCK_WIDGET_NAMES = ["datetimeutc", "datetime"]
+# Number of clock reads for the offset (the median is used)
+CLOCK_READS = 3
+
+# A captured picture on the camera, with its shutter time in system time
+# and in camera time (i.e., as found in the EXIF data of the picture)
+Capture = namedtuple("Capture", ["camera", "file_path", "timestamp", "camera_time"])
+
+
+class CameraHealth:
+    """Health state of a camera connection, as published in the status."""
+
+    OK = "ok"
+    FAILING = "failing"
+    DISCONNECTED = "disconnected"
+
+    def __init__(self, backoff_min=30, backoff_max=600):
+        self.state = self.DISCONNECTED
+        self.reconnect_count = 0
+        self.failure_count = 0
+        self.connected_at = None
+        self.last_probe = None
+        self.next_reconnect = 0.0
+        self.backoff_min = backoff_min
+        self.backoff_max = backoff_max
+        self.backoff = backoff_min
+
+    def mark_ok(self):
+        self.state = self.OK
+        self.failure_count = 0
+        self.backoff = self.backoff_min
+
+    def mark_failed(self, disconnected=False):
+        """Record a failure and schedule the next reconnect (exp. backoff)."""
+        self.state = self.DISCONNECTED if disconnected else self.FAILING
+        self.failure_count += 1
+        self.next_reconnect = time.monotonic() + self.backoff
+        self.backoff = min(2 * self.backoff, self.backoff_max)
+
+    @property
+    def reconnect_due(self):
+        return self.state != self.OK and time.monotonic() >= self.next_reconnect
+
+    def as_dict(self):
+        return {
+            "state": self.state,
+            "reconnects": self.reconnect_count,
+            "failures": self.failure_count,
+            "last_probe": self.last_probe,
+        }
+
+
 class MothCamera:
-    """Interface to the Sony alpha 6000."""
+    """Interface to the Sony alpha 6000.
 
-    camera = None
-    camera_found = False
+    If a port (e.g., "usb:001,004") is given, the camera on this port
+    is addressed; otherwise, gphoto2 picks the first camera it finds.
+    """
 
-    def __init__(self, autoconnect=False):
+    def __init__(
+        self, autoconnect=False, port=None, model=None, camera_id="cam0", settings=None
+    ):
+        self.camera = None
+        self.camera_found = False
+        self.port = port
+        self.model = model
+        self.camera_id = camera_id
+        # desired camera settings {widget name: value}, applied on reconnect
+        self.settings = settings or {}
+        self._config = None
+        # camera clock minus system clock (s), None if not calibrated
+        self.clock_offset = None
+        self.sync_clock = False
+        self.health = CameraHealth()
+        # serializes gphoto2 calls of the capture and health monitor threads
+        self.lock = RLock()
         if autoconnect:
             self.reconnect()
 
+    def _open(self):
+        """Create the gphoto2 camera object, bound to the port if given."""
+        camera = gp.Camera()
+        if self.port:
+            port_info_list = gp.PortInfoList()
+            port_info_list.load()
+            camera.set_port_info(port_info_list[port_info_list.lookup_path(self.port)])
+        if self.model:
+            abilities_list = gp.CameraAbilitiesList()
+            abilities_list.load()
+            camera.set_abilities(
+                abilities_list[abilities_list.lookup_model(self.model)]
+            )
+        camera.init()
+        return camera
+
     def reconnect(self):
         """Connect or reconnect to the camera."""
-        if self.camera:
-            self.close()
-        try:
-            self.camera = gp.Camera()
-            self.camera.init()
-            self.camera_found = True
-            logging.info("Reconnect: Camera is available.")
-        except gp.GPhoto2Error:
-            self.camera = None
-            logging.error("Reconnect: No Camera found!")
+        with self.lock:
+            if self.camera:
+                self.close()
+            self.health.reconnect_count += 1
+            self._config = None
+            try:
+                self.camera = self._open()
+                self.camera_found = True
+                self.health.mark_ok()
+                self.health.connected_at = time.monotonic()
+                logging.info(f"Reconnect: Camera {self.camera_id} is available.")
+            except gp.GPhoto2Error:
+                self.camera = None
+                self.health.mark_failed(disconnected=True)
+                logging.error(f"Reconnect: Camera {self.camera_id} not found!")
+                return
+            if self.settings:
+                self.apply_settings(self.settings)
+            if self.sync_clock:
+                self.set_camera_clock()
+            self.calibrate_clock()
 
     @property
     def is_available(self):
-        """Return the stored camer status.
-        Could be extended to make a self-check.
+        """Return the camera status, as determined by the last probe or call."""
+        return self.camera is not None and self.health.state == CameraHealth.OK
+
+    def probe(self):
+        """Cheap self-check of the USB connection.
+
+        Storage information is a single PTP request, in contrast to
+        get_config() that walks the whole widget tree.
+        """
+        with self.lock:
+            if self.camera is None:
+                return False
+            try:
+                self.camera.get_storageinfo()
+            except gp.GPhoto2Error as e:
+                logging.warning(f"Camera {self.camera_id} probe failed: {e}")
+                self.health.mark_failed()
+                return False
+            finally:
+                self.health.last_probe = datetime.datetime.now()
+            self.health.mark_ok()
+            return True
+
+    def check_health(self, refresh_interval=None):
+        """Probe the camera and reconnect with backoff if needed.
+
+        Also reconnects a healthy camera after refresh_interval seconds
+        to avoid the automatic standby of the camera.
         """
-        return True if self.camera else False
+        if self.camera is not None and self.health.state == CameraHealth.OK:
+            connected_for = time.monotonic() - (self.health.connected_at or 0)
+            if refresh_interval and connected_for > refresh_interval:
+                self.reconnect()
+            else:
+                self.probe()
+        elif self.health.reconnect_due:
+            self.reconnect()
+        return self.health.state
 
     def summary(self):
         """Get a camera summary.
@@ -63,56 +218,401 @@ class MothCamera:
             text = "Camera Summary: Camera not connected."
         return str(text)
 
+    def read_settings(self, refresh=False):
+        """Read the config widget tree from the camera and cache it.
+
+        Reading the tree walks all widgets over USB, so this is only done
+        once per connection, or if refresh is requested.
+        """
+        with self.lock:
+            if self.camera is None:
+                return None
+            if self._config is None or refresh:
+                try:
+                    self._config = self.camera.get_config()
+                except gp.GPhoto2Error as e:
+                    logging.error(f"Reading settings failed ({self.camera_id}): {e}")
+                    self._config = None
+            return self._config
+
+    def get_setting(self, name):
+        """Return the cached value of a config widget (or None)."""
+        config = self.read_settings()
+        if config is None:
+            return None
+        try:
+            return config.get_child_by_name(name).get_value()
+        except gp.GPhoto2Error:
+            return None
+
+    def apply_settings(self, settings: dict):
+        """Apply desired settings {widget name: value}.
+
+        Only values that differ from the cached widget tree are changed,
+        and all changes are written in a single set_config() call.
+        Returns a dict of the changed settings.
+        """
+        with self.lock:
+            config = self.read_settings()
+            if config is None:
+                return {}
+            changed = {}
+            for name, value in settings.items():
+                try:
+                    widget = config.get_child_by_name(name)
+                except gp.GPhoto2Error:
+                    logging.warning(f"Camera {self.camera_id} has no setting {name}")
+                    continue
+                current = widget.get_value()
+                try:
+                    value = type(current)(value)
+                except (TypeError, ValueError):
+                    logging.warning(f"Invalid value {name}={value} ({type(current)})")
+                    continue
+                if value == current:
+                    continue
+                if widget.get_type() in (gp.GP_WIDGET_RADIO, gp.GP_WIDGET_MENU):
+                    choices = list(widget.get_choices())
+                    if value not in choices:
+                        logging.warning(f"Invalid value {name}={value}, use {choices}")
+                        continue
+                widget.set_value(value)
+                changed[name] = value
+            if changed:
+                try:
+                    self.camera.set_config(config)
+                    logging.info(f"Camera {self.camera_id} settings: {changed}")
+                except gp.GPhoto2Error as e:
+                    logging.error(f"Applying settings failed ({self.camera_id}): {e}")
+                    self._config = None
+                    return {}
+            return changed
+
+    def _get_clock_widget(self):
+        """Return the date/time widget of the camera, or None."""
+        for name in CLOCK_WIDGET_NAMES:
+            try:
+                widget = self.camera.get_single_config(name)
+            except gp.GPhoto2Error:
+                continue
+            if widget.get_type() == gp.GP_WIDGET_DATE:
+                return widget
+        return None
+
     def get_camera_clock(self):
-        """It would be nice to have a function to determine the time from the camera.
+        """Read the time from the camera clock.
+
         The Sony alpha 6000 has an integrated clock with a limited battery.
-        Maybe see get_file_time() for an alternative.
+        Returns a tuple (camera timestamp, system timestamp at the time of
+        reading), or None if the camera has no readable clock.
         """
-        raise NotImplementedError
+        with self.lock:
+            if self.camera is None:
+                return None
+            start = time.time()
+            widget = self._get_clock_widget()
+            if widget is None:
+                return None
+            return widget.get_value(), (start + time.time()) / 2
 
-    def capture(self):
-        """Capture."""
-        if self.camera_found:
-            file_path = None
+    def calibrate_clock(self):
+        """Determine the offset of the camera clock against the system time.
+
+        This is done once per connection; captures are then annotated
+        with both times without querying the camera for each file.
+        """
+        offsets = []
+        for _ in range(CLOCK_READS):
+            clock = self.get_camera_clock()
+            if clock is None:
+                logging.warning(f"Camera {self.camera_id}: clock not readable.")
+                self.clock_offset = None
+                return None
+            camera_time, system_time = clock
+            # the camera clock truncates to full seconds: on average, the
+            # actual camera time is half a second later than its reading
+            offsets.append(camera_time + 0.5 - system_time)
+        self.clock_offset = round(statistics.median(offsets))
+        logging.info(f"Camera {self.camera_id} clock offset: {self.clock_offset}s")
+        return self.clock_offset
+
+    def set_camera_clock(self):
+        """Set the camera clock to the system time of the Pi."""
+        with self.lock:
+            if self.camera is None:
+                return False
+            widget = self._get_clock_widget()
+            if widget is None:
+                return False
+            widget.set_value(int(time.time()))
             try:
-                file_path = self.camera.capture(gp.GP_CAPTURE_IMAGE)
+                self.camera.set_single_config(widget.get_name(), widget)
             except gp.GPhoto2Error as e:
-                cam_active_str = (
-                    "Cam available" if self.camera.is_available else "no camera"
-                )
-                logging.error(f"GPhoto2Error ({cam_active_str}): {e}")
-                self.reconnect()
-                try:  # try again
-                    file_path = self.camera.capture()
-                except:
-                    logging.error("Camera capture failed again after reconnect.")
-            if file_path:
-                return file_path
-        logging.warning("No Capture, camera not connected.")
+                logging.error(f"Setting the clock failed ({self.camera_id}): {e}")
+                return False
+            logging.info(f"Camera {self.camera_id} clock set to system time.")
+            return True
+
+    @metrics.timed("camera_capture_seconds", "Time to trigger a capture")
+    def capture(self):
+        """Capture.
+
+        On failure, the camera is marked as failing; reconnecting is left
+        to the health monitor so that the capture tick is not delayed.
+        """
+        if self.is_available:
+            with self.lock:
+                try:
+                    timestamp = time.time()
+                    file_path = self.camera.capture(gp.GP_CAPTURE_IMAGE)
+                    camera_time = None
+                    if self.clock_offset is not None:
+                        camera_time = timestamp + self.clock_offset
+                    return Capture(self, file_path, timestamp, camera_time)
+                except gp.GPhoto2Error as e:
+                    logging.error(f"GPhoto2Error (camera {self.camera_id}): {e}")
+                    metrics.counter("capture_failures_total").inc()
+                    self.health.mark_failed()
+                    return None
+        logging.warning(f"No Capture, camera {self.camera_id} not connected.")
         return None
 
-    def save(self, file_path, target=Path("/tmp") / "out.jpg"):
-        """Save the picture."""
+    @metrics.timed("camera_save_seconds", "Time to download and save a picture")
+    def save(self, file_path, target=Path("/tmp") / "out.jpg", timestamp=None):
+        """Save the picture.
+
+        If a timestamp is given, the modification time of the file is
+        set to it (e.g., to the corrected capture time).
+        Returns True if the picture was downloaded.
+        """
         if self.is_available:
-            logging.info(f"Copying image {file_path.name} to {target}")
-            camera_file = self.camera.file_get(
-                file_path.folder, file_path.name, gp.GP_FILE_TYPE_NORMAL
-            )
-            camera_file.save(str(target))
+            logging.debug(f"Copying image {file_path.name} to {target}")
+            with self.lock:
+                try:
+                    camera_file = self.camera.file_get(
+                        file_path.folder, file_path.name, gp.GP_FILE_TYPE_NORMAL
+                    )
+                    camera_file.save(str(target))
+                    if timestamp:
+                        os.utime(target, (timestamp, timestamp))
+                    metrics.counter("pictures_saved_total").inc()
+                    return True
+                except gp.GPhoto2Error as e:
+                    logging.error(f"Download failed (camera {self.camera_id}): {e}")
+                    self.health.mark_failed()
+        return False
 
     def close(self):
         """Close the connection to the camera."""
-        if self.is_available:
-            self.camera.exit()
-            self.camera = None
+        with self.lock:
+            if self.camera is not None:
+                try:
+                    self.camera.exit()
+                except gp.GPhoto2Error as e:
+                    logging.warning(f"Camera {self.camera_id} exit failed: {e}")
+                self.camera = None
+                self.health.state = CameraHealth.DISCONNECTED
 
     def get_file_time(self, filename):
-        """Get time information from the image file."""
+        """Get time information from the image file.
+
+        This needs a USB round trip per file; captures are already
+        annotated with calibrated times, see calibrate_clock().
+        """
         info = get_file_info(self.camera, filename)
         mtime = datetime.datetime.fromtimestamp(info.file.mtime).isoformat(" ")
         return mtime
 
 
+class CameraGroup:
+    """Coordinate one or more cameras that capture the same sheet.
+
+    All cameras are triggered concurrently, and the pictures are
+    downloaded in parallel. Saved files are tagged with the camera id.
+    """
+
+    def __init__(
+        self,
+        autodetect=True,
+        backoff_min=30,
+        backoff_max=600,
+        settings=None,
+        sync_clock=False,
+    ):
+        self.cameras = []
+        self.autodetect = autodetect
+        self.backoff = (backoff_min, backoff_max)
+        self.settings = settings or {}
+        self.sync_clock = sync_clock
+
+    def _new_camera(self, **kwargs):
+        camera = MothCamera(settings=self.settings, **kwargs)
+        camera.sync_clock = self.sync_clock
+        camera.health.backoff_min, camera.health.backoff_max = self.backoff
+        camera.health.backoff = camera.health.backoff_min
+        return camera
+
+    def reconnect(self):
+        """Detect cameras and (re-)connect to all of them.
+
+        Cameras that are still found on the same port keep their
+        camera id and health statistics.
+        """
+        detected = detect_cameras() if self.autodetect else []
+        known = {camera.port: camera for camera in self.cameras}
+        if detected:
+            logging.info(f"Detected cameras: {detected}")
+            taken = {known[port].camera_id for _, port in detected if port in known}
+            free_ids = (f"cam{i}" for i in range(len(detected) + len(taken)))
+            free_ids = (camera_id for camera_id in free_ids if camera_id not in taken)
+            cameras = [
+                known.pop(port, None)
+                or self._new_camera(port=port, model=model, camera_id=next(free_ids))
+                for model, port in detected
+            ]
+        else:
+            # fall back to the first camera gphoto2 finds
+            cameras = [known.pop(None, None) or self._new_camera()]
+        for camera in known.values():
+            camera.close()
+        self.cameras = cameras
+        self._map(lambda camera: camera.reconnect())
+
+    def rebind(self):
+        """Move disconnected cameras to the port they are detected on now.
+
+        A camera that was replugged, or re-enumerated after a USB reset,
+        shows up on a new port. It is matched by model to a detected port
+        that no other camera uses; new cameras are only added by reconnect().
+        """
+        detected = detect_cameras()
+        detected_ports = {port for _, port in detected}
+        free = [
+            (model, port)
+            for model, port in detected
+            if port not in {camera.port for camera in self.cameras}
+        ]
+        for camera in self.cameras:
+            if (
+                camera.health.state != CameraHealth.DISCONNECTED
+                or not camera.health.reconnect_due
+                or camera.port in detected_ports
+            ):
+                continue
+            for model, port in free:
+                if camera.model in (None, model):
+                    logging.info(
+                        f"Camera {camera.camera_id} moved from {camera.port} to {port}."
+                    )
+                    camera.port = port
+                    free.remove((model, port))
+                    break
+
+    def camera_by_id(self, camera_id):
+        """Return the camera with the given id, or None."""
+        for camera in self.cameras:
+            if camera.camera_id == camera_id:
+                return camera
+        return None
+
+    @property
+    def is_available(self):
+        """True if at least one camera is connected."""
+        return any(camera.is_available for camera in self.cameras)
+
+    def availability(self):
+        """Return a dict {camera_id: is_available}."""
+        return {camera.camera_id: camera.is_available for camera in self.cameras}
+
+    def clock_offsets(self):
+        """Return a dict {camera_id: clock offset in seconds}."""
+        return {camera.camera_id: camera.clock_offset for camera in self.cameras}
+
+    def health(self):
+        """Return a dict {camera_id: health state dict}."""
+        return {camera.camera_id: camera.health.as_dict() for camera in self.cameras}
+
+    def check_health(self, refresh_interval=None):
+        """Probe all cameras in parallel and reconnect failing ones.
+
+        If no camera could be set up at all, try the detection again;
+        disconnected cameras are rebound to their new port before their
+        reconnect.
+        """
+        lost = [
+            camera.health.state == CameraHealth.DISCONNECTED
+            and camera.health.reconnect_due
+            for camera in self.cameras
+        ]
+        if not self.cameras or all(lost):
+            self.reconnect()
+            return
+        if self.autodetect and any(lost):
+            self.rebind()
+        self._map(lambda camera: camera.check_health(refresh_interval))
+
+    def _map(self, function, *iterables):
+        """Run a function for each camera in parallel threads."""
+        if not self.cameras:
+            return []
+        with ThreadPoolExecutor(max_workers=len(self.cameras)) as executor:
+            return list(executor.map(function, self.cameras, *iterables))
+
+    def capture(self):
+        """Trigger all cameras at once.
+
+        Returns a list of Capture tuples for successful captures.
+        """
+        return [capture for capture in self._map(lambda c: c.capture()) if capture]
+
+    def save(self, captures, folder, basename):
+        """Download the captured pictures in parallel.
+
+        The files are saved as ``<basename>_<camera_id>.jpg`` in folder.
+        Returns a list of (capture, target path) of the downloaded pictures.
+        """
+        if not captures:
+            return []
+        targets = [
+            Path(folder) / f"{basename}_{capture.camera.camera_id}.jpg"
+            for capture in captures
+        ]
+        with ThreadPoolExecutor(max_workers=len(captures)) as executor:
+            success = list(
+                executor.map(
+                    lambda capture, target: capture.camera.save(
+                        capture.file_path, target, timestamp=capture.timestamp
+                    ),
+                    captures,
+                    targets,
+                )
+            )
+        return [
+            (capture, target)
+            for capture, target, ok in zip(captures, targets, success)
+            if ok
+        ]
+
+    def apply_settings(self, settings: dict):
+        """Apply settings to all cameras; return {camera_id: changed}."""
+        self.settings = settings
+        for camera in self.cameras:
+            camera.settings = settings
+        changed = self._map(lambda camera: camera.apply_settings(settings))
+        return {camera.camera_id: c for camera, c in zip(self.cameras, changed)}
+
+    def summary(self):
+        """Concatenated summaries of all cameras."""
+        return "\n".join(
+            f"{camera.camera_id}: {camera.summary()}" for camera in self.cameras
+        )
+
+    def close(self):
+        """Close all camera connections."""
+        for camera in self.cameras:
+            camera.close()
+
+
 def list_files(camera, path="/"):
     """List all files in a camera directory."""
     result = []
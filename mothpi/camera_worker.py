@@ -0,0 +1,247 @@
+# !/usr/bin/python3
+# -*- coding:utf-8 -*-
+
+"""
+Camera worker process for Mothpi.
+
+All libgphoto2 calls are executed in a dedicated child process, so that
+a hung USB transfer cannot block the timers, buttons or the web app.
+The parent talks to the worker over a pipe; every call has a hard
+timeout, and a hanging or crashed worker is killed and restarted.
+
+2021, Technische Universität München, Ludwig Kürzinger
+"""
+
+import logging
+import multiprocessing
+import time
+from collections import namedtuple
+from threading import Lock
+
+from mothpi.camera import CameraGroup, Capture
+from mothpi.logbuffer import setup_process_logging
+from mothpi.metrics import metrics
+from mothpi.simulation import SIMULATE, simulation
+
+# A file on the camera, as sent between the processes
+CameraFile = namedtuple("CameraFile", ["folder", "name"])
+
+# Commands the worker understands, with their default timeout (s)
+COMMAND_TIMEOUTS = {
+    "reconnect": 60,
+    "check_health": 60,
+    "capture": 30,
+    "save": 60,
+    "apply_settings": 30,
+    "summary": 10,
+    "close": 10,
+}
+
+
+def _snapshot(group: CameraGroup):
+    """Camera state that the parent process caches after each call."""
+    return {
+        "is_available": group.is_available,
+        "availability": group.availability(),
+        "health": group.health(),
+        "clock_offsets": group.clock_offsets(),
+        "metrics": metrics.state(),
+    }
+
+
+def _to_message(capture: Capture):
+    return Capture(
+        capture.camera.camera_id,
+        CameraFile(capture.file_path.folder, capture.file_path.name),
+        capture.timestamp,
+        capture.camera_time,
+    )
+
+
+def _from_message(group: CameraGroup, capture: Capture):
+    camera = group.camera_by_id(capture.camera)
+    if camera is None:
+        return None
+    return capture._replace(camera=camera)
+
+
+def _execute(group: CameraGroup, command, args, kwargs):
+    """Execute a command on the camera group inside the worker."""
+    if command == "capture":
+        return [_to_message(capture) for capture in group.capture()]
+    if command == "save":
+        captures, *args = args
+        captures = [_from_message(group, capture) for capture in captures]
+        saved = group.save([c for c in captures if c], *args, **kwargs)
+        return [(_to_message(capture), target) for capture, target in saved]
+    if command == "summary":
+        return group.summary()
+    if command in COMMAND_TIMEOUTS:
+        return getattr(group, command)(*args, **kwargs)
+    raise ValueError(f"Unknown camera worker command: {command}")
+
+
+def worker_main(connection, group_kwargs, log_level, simulation_state=None):
+    """Main loop of the worker process."""
+    setup_process_logging(log_level)
+    # only report the metrics of this process, the parent has its own
+    metrics.reset()
+    if simulation_state:
+        vars(simulation).update(simulation_state)
+    group = CameraGroup(**group_kwargs)
+    while True:
+        try:
+            command, args, kwargs = connection.recv()
+        except (EOFError, KeyboardInterrupt):
+            break
+        try:
+            result = _execute(group, command, args, kwargs)
+            reply = (True, result, _snapshot(group))
+        except Exception as e:
+            logging.exception(f"Camera worker: {command} failed")
+            reply = (False, repr(e), _snapshot(group))
+        connection.send(reply)
+        if command == "close":
+            break
+
+
+class CameraWorker:
+    """Run a CameraGroup in a supervised child process.
+
+    Provides the same high-level calls as CameraGroup. Camera states
+    (availability, health, clock offsets) are cached from the last reply
+    and can be read without a round trip to the worker.
+
+    The worker is started from a fork server: forking the multithreaded
+    daemon itself could copy locks held by other threads into the child,
+    e.g., of the logging handlers.
+    """
+
+    def __init__(self, timeout_factor=1.0, **group_kwargs):
+        self.group_kwargs = group_kwargs
+        self.timeout_factor = timeout_factor
+        self.restart_count = 0
+        self._lock = Lock()
+        self._process = None
+        self._connection = None
+        self._snapshot = {}
+        self._start()
+
+    def _start(self):
+        context = multiprocessing.get_context("forkserver")
+        self._connection, child_connection = context.Pipe()
+        self._process = context.Process(
+            target=worker_main,
+            args=(
+                child_connection,
+                self.group_kwargs,
+                logging.getLogger().getEffectiveLevel(),
+                dict(vars(simulation)) if SIMULATE else None,
+            ),
+            name="mothpi-camera",
+            daemon=True,
+        )
+        self._process.start()
+        child_connection.close()
+        self._snapshot = {}
+        logging.info(f"Camera worker started (pid {self._process.pid}).")
+
+    def _kill(self):
+        self._connection.close()
+        self._process.terminate()
+        self._process.join(2)
+        if self._process.is_alive():
+            self._process.kill()
+            self._process.join(2)
+
+    def restart(self):
+        """Kill the worker and start a fresh one (cameras reconnect later)."""
+        with self._lock:
+            self._restart()
+
+    def _restart(self):
+        logging.error("Restarting the camera worker.")
+        self._kill()
+        self.restart_count += 1
+        self._start()
+
+    def call(self, command, *args, default=None, **kwargs):
+        """Send a command to the worker and wait for the reply.
+
+        If the worker does not answer within the timeout of the command
+        or has died, it is restarted and default is returned.
+        """
+        timeout = COMMAND_TIMEOUTS[command] * self.timeout_factor
+        with self._lock:
+            start = time.monotonic()
+            try:
+                self._connection.send((command, args, kwargs))
+                if not self._connection.poll(timeout):
+                    raise TimeoutError(f"no reply within {timeout}s")
+                success, result, self._snapshot = self._connection.recv()
+                metrics.set_remote("camera_worker", self._snapshot["metrics"])
+            except (TimeoutError, EOFError, OSError) as e:
+                logging.error(f"Camera worker: {command} failed ({e}).")
+                self._restart()
+                return default
+            logging.debug(
+                f"Camera worker: {command} in {time.monotonic() - start:.2f}s"
+            )
+            if not success:
+                logging.error(f"Camera worker: {command} raised {result}")
+                return default
+            return result
+
+    def reconnect(self):
+        """Connect or reconnect to all cameras."""
+        self.call("reconnect")
+
+    def check_health(self, refresh_interval=None):
+        """Probe the cameras and reconnect with backoff if needed.
+
+        A dead worker is restarted here as well.
+        """
+        if not self._process.is_alive():
+            self.restart()
+        self.call("check_health", refresh_interval=refresh_interval)
+
+    def capture(self):
+        """Trigger all cameras at once; return a list of Capture tuples."""
+        return self.call("capture", default=[])
+
+    def save(self, captures, folder, basename):
+        """Download the captured pictures; return [(capture, target path)]."""
+        return self.call("save", captures, folder, basename, default=[])
+
+    def apply_settings(self, settings: dict):
+        """Apply settings to all cameras; return {camera_id: changed}."""
+        self.group_kwargs["settings"] = settings
+        return self.call("apply_settings", settings, default={})
+
+    def summary(self):
+        return self.call("summary", default="Camera Summary: worker not responding.")
+
+    def close(self):
+        """Close the camera connections and stop the worker."""
+        with self._lock:
+            if self._process.is_alive():
+                try:
+                    self._connection.send(("close", (), {}))
+                    self._connection.poll(COMMAND_TIMEOUTS["close"])
+                except OSError:
+                    pass
+            self._kill()
+
+    @property
+    def is_available(self):
+        """True if at least one camera is connected."""
+        return self._snapshot.get("is_available", False)
+
+    def availability(self):
+        return self._snapshot.get("availability", {})
+
+    def health(self):
+        return self._snapshot.get("health", {})
+
+    def clock_offsets(self):
+        return self._snapshot.get("clock_offsets", {})
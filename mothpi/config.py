@@ -11,10 +11,14 @@ and stores the configuration.
 """
 
 import logging
+import copy
+import os
 from pathlib import Path
 from types import SimpleNamespace
 import json
 
+from mothpi.trigger import RESERVED_PINS
+
 MOTHPI_BASE_DIRECTORY = Path.home() / "mothpi"
 CONFIG_BASE_NAME = "mothpi.conf"
 # Add possible configuration file locations (last item is taken first)
@@ -23,6 +27,11 @@ CONFIG_FILE_PATHS: list = [
     Path.home() / CONFIG_BASE_NAME,
     Path.home() / ".mothpi",
 ]
+# Functions that are called with the set of changed keys on config changes.
+# (kept outside of MothConf, as its __dict__ is saved as configuration)
+_change_listeners: list = []
+# Modification time of config files as last read or written
+_config_file_mtimes: dict = {}
 
 
 class MothConf(SimpleNamespace):
@@ -50,16 +59,89 @@ class MothConf(SimpleNamespace):
     polling_interval = 60 * 1
     _cam_reconnect_interval = "Interval time to reconnect to the camera (s)"
     cam_reconnect_interval = 60 * 60 * 5
+    _log_ring_size = "Number of recent log messages kept in memory"
+    log_ring_size = 2000
+    _log_batch_size = "Write log messages to disk in batches of this size"
+    log_batch_size = 100
+    _log_flush_interval = "Write log messages to disk at least every ... (s)"
+    log_flush_interval = 60 * 5
+    _startup_budget = "Maximum waiting time for the hardware at startup (s)"
+    startup_budget = 30
+    _watchdog_stall_threshold = (
+        "Restart via systemd watchdog if capture or status jobs are "
+        "overdue by this time (s)"
+    )
+    watchdog_stall_threshold = 60 * 10
+    _config_watch_interval = "Check the configuration file for changes (s)"
+    config_watch_interval = 10
+    _cam_health_interval = "Interval to probe the camera connection (s)"
+    cam_health_interval = 30
+    _cam_reconnect_backoff_max = (
+        "Maximum waiting time between reconnect attempts to a failing camera (s)"
+    )
+    cam_reconnect_backoff_max = 60 * 10
+    # Desired camera settings as {gphoto2 widget name: value}, applied after
+    # each reconnect, e.g. {"iso": "400", "shutterspeed": "1/125",
+    # "flashmode": "Fill flash", "capturetarget": "Memory card"}
+    # (see "gphoto2 --list-config" for the names of a camera)
+    camera_settings = {}
+    _camera_clock_sync = "Set the camera clock to the system time on connect"
+    camera_clock_sync = False
+    _camera_worker_process = (
+        "Run the camera in a separate process that is restarted if it hangs"
+    )
+    camera_worker_process = True
+    _camera_autodetect = "Detect all connected cameras and capture with each of them"
+    camera_autodetect = True
+    # optional: capture on signals of a PIR sensor or light barrier
+    _trigger_pin = "GPIO pin (BCM) of a sensor that triggers a capture (0: off)"
+    trigger_pin = 0
+    _trigger_pull_up = "The trigger sensor is active low (use the pull-up)"
+    trigger_pull_up = False
+    _trigger_debounce = "Ignore trigger signals shortly after the last one (s)"
+    trigger_debounce = 0.2
+    _trigger_min_spacing = "Minimum time between a triggered and any capture (s)"
+    trigger_min_spacing = 15.0
+    _trigger_max_per_hour = "Maximum number of triggered captures per hour"
+    trigger_max_per_hour = 60
     # Folder to save pictures
     # _pictures_save_folder = "Folder to save pictures in (Path)"
     pictures_save_folder = str(Path.home() / "pics")
     status_image_filename = "epaper_display.png"
+    # Status history (ring buffer, one sample per status poll)
+    history_file = str(Path.home() / ".mothpi_history.npy")
+    history_size = 7 * 24 * 60
     # Pictures file format (without * and .)
     # _pictures_file_format = "Pictures file format (without * and .)"
     pictures_file_format = "jpg"
+    # optional: upload a compact copy of each picture (originals stay local)
+    _upload_copy = "Upload cropped and re-encoded copies of the pictures"
+    upload_copy = False
+    _upload_quality = "JPEG quality of upload copies (1-95)"
+    upload_quality = 80
+    # Region of interest (the sheet) for upload copies, relative coordinates
+    # [left, top, right, bottom]
+    upload_roi = [0.0, 0.0, 1.0, 1.0]
+    _originals_min_free_mb = "Delete the oldest originals below this free space (MB)"
+    originals_min_free_mb = 500
+    _manifest_format = "Format of the nightly manifest (parquet, arrow or csv)"
+    manifest_format = "parquet"
     # Default relais config
     # _relais_conf = "Default relais configuration"
     relais_conf = {1: False, 2: False, 3: True}
+    # Power draw of the devices switched by the relais (W)
+    relais_power_w = {1: 0.0, 2: 0.0, 3: 10.0}
+    _base_power_w = "Power draw of the Raspberry Pi and the cameras (W)"
+    base_power_w = 4.0
+    _capture_energy_wh = "Energy per captured and downloaded picture (Wh)"
+    capture_energy_wh = 0.02
+    _energy_budget_wh = "Energy budget per night until sunrise (Wh, 0: no budget)"
+    energy_budget_wh = 0.0
+    _energy_budget_mode = (
+        "Fit the budget by stretching the capture interval (interval) "
+        "or by switching the lamp off early (lamp)"
+    )
+    energy_budget_mode = "interval"
     config_file_name = None
     # optional: use weather data to restrict storage use
     _use_weather_data = "Optional: use weather data to restrict storage use"
@@ -103,6 +185,7 @@ class MothConf(SimpleNamespace):
         else:
             logging.info(f"Loading configuration from {config_file}")
             try:
+                self._remember_file_mtime(config_file)
                 with open(config_file, "r") as f:
                     config = json.load(f)
                 self.update_from_dict(config)
@@ -116,6 +199,41 @@ class MothConf(SimpleNamespace):
         logging.info(f"Saving the configuration in file {self.config_file_name}")
         with open(self.config_file_name, "w") as f:
             json.dump(self.__dict__, f)
+        self._remember_file_mtime(self.config_file_name)
+
+    @staticmethod
+    def _remember_file_mtime(config_file):
+        try:
+            _config_file_mtimes[str(config_file)] = os.stat(config_file).st_mtime
+        except OSError:
+            pass
+
+    def reload_if_changed(self):
+        """Reload the configuration file if it was edited on disk.
+
+        Returns True if the file was reloaded.
+        """
+        try:
+            mtime = os.stat(self.config_file_name).st_mtime
+        except OSError:
+            return False
+        if mtime == _config_file_mtimes.get(self.config_file_name):
+            return False
+        _config_file_mtimes[self.config_file_name] = mtime
+        logging.info(f"Configuration file {self.config_file_name} changed, reloading")
+        try:
+            with open(self.config_file_name, "r") as f:
+                config = json.load(f)
+        except (OSError, ValueError) as e:
+            logging.error(f"Error reading configuration file: {e}")
+            return False
+        self.update_from_dict(config)
+        return True
+
+    @staticmethod
+    def add_change_listener(listener):
+        """Register a function that is called with the set of changed keys."""
+        _change_listeners.append(listener)
 
     def get_dict(self):
         """Return a dict of all changeable parameters, only with descriptions."""
@@ -179,12 +297,65 @@ class MothConf(SimpleNamespace):
             )
             self.cam_reconnect_interval = 60 * 60 * 5
             config_changed = True
+        if not 5 <= self.cam_health_interval <= 3600:
+            logging.warning(
+                f"Parameter cam_health_interval out of bounds {self.cam_health_interval}"
+            )
+            self.cam_health_interval = 30
+            config_changed = True
+        if self.trigger_pin in RESERVED_PINS or not 0 <= self.trigger_pin <= 27:
+            logging.warning(f"Parameter trigger_pin not usable {self.trigger_pin}")
+            self.trigger_pin = 0
+            config_changed = True
+        if self.energy_budget_mode not in ["interval", "lamp"]:
+            logging.warning(
+                f"Parameter energy_budget_mode not supported {self.energy_budget_mode}"
+            )
+            self.energy_budget_mode = "interval"
+            config_changed = True
+        if self.energy_budget_wh < 0:
+            logging.warning(
+                f"Parameter energy_budget_wh out of bounds {self.energy_budget_wh}"
+            )
+            self.energy_budget_wh = 0.0
+            config_changed = True
+        if self.manifest_format not in ["parquet", "arrow", "csv"]:
+            logging.warning(
+                f"Parameter manifest_format not supported {self.manifest_format}"
+            )
+            self.manifest_format = "parquet"
+            config_changed = True
+        if not 1 <= self.upload_quality <= 95:
+            logging.warning(
+                f"Parameter upload_quality out of bounds {self.upload_quality}"
+            )
+            self.upload_quality = 80
+            config_changed = True
         return config_changed
 
     def update_from_dict(self, config_dictionary: dict):
-        """Apply changes to config and validate."""
+        """Apply changes to config and validate.
+
+        Registered change listeners are notified of the changed keys.
+        """
+        previous = copy.deepcopy(self.__dict__)
         self.__dict__.update(config_dictionary)
-        return not self.validate_configuration()
+        # JSON only has string keys
+        self.relais_conf = {int(k): v for k, v in self.relais_conf.items()}
+        self.relais_power_w = {int(k): v for k, v in self.relais_power_w.items()}
+        success = not self.validate_configuration()
+        changed = {
+            key
+            for key, value in self.__dict__.items()
+            if key not in previous or previous[key] != value
+        }
+        if changed:
+            for listener in _change_listeners:
+                try:
+                    listener(changed)
+                except Exception:
+                    logging.exception("Error applying configuration change")
+        return success
 
 
 # This sets the global object for configuration
@@ -10,15 +10,20 @@ E-Paper display interface for Mothpi.
 
 import logging
 import datetime
+from threading import Lock
 from pathlib import Path
 from PIL import Image, ImageDraw, ImageFont  # import the image libraries
 
+from mothpi.metrics import metrics
+from mothpi.simulation import SIMULATE
+
 EPAPER_HEIGHT = 264
 EPAPER_WIDTH = 176
 
 # First font found wins
 LIST_OF_FONTS = [
     "../extras/NotoSans-ExtraCondensedSemiBold.ttf",
+    str(Path(__file__).parent.parent / "extras/NotoSans-ExtraCondensedSemiBold.ttf"),
     "/usr/share/fonts/truetype/noto/NotoSans-ExtraCondensedSemiBold.ttf",
     "/usr/share/fonts/noto/NotoSans-ExtraCondensedSemiBold.ttf",
     "/usr/share/fonts/truetype/google/Bangers-Regular.ttf",
@@ -34,28 +39,53 @@ for item in LIST_OF_FONTS:
         logging.info(f"Display font: {DISPLAY_FONT}")
         break
 
-try:
-    from waveshare_epd import epd2in7
-    from gpiozero import Button  # import the Button control from gpiozero
-
-    button_pins = {1: 5, 2: 6, 3: 13, 4: 19}
-    button_by_pin = {v: k for k, v in button_pins.items()}
-    btn1 = Button(button_pins[1])  # assign each button to a variable
-    btn2 = Button(button_pins[2])  # by passing in the pin number
-    btn3 = Button(button_pins[3])  # associated with the button
-    btn4 = Button(button_pins[4])  #
-
-    epd = epd2in7.EPD()  # get the display object and assing to epd
-    epd.init()  # initialize the display
-    print("Clear...")  # print message to console (not display) for debugging
-    epd.Clear(0xFF)  # clear the display
-
-    DISPLAY_AVAILABLE = True
-    logging.info("Display found.")
-except:
-    logging.error("No display found!")
-    DISPLAY_AVAILABLE = False
-    epd = False
+button_pins = {1: 5, 2: 6, 3: 13, 4: 19}
+button_by_pin = {v: k for k, v in button_pins.items()}
+buttons = {}
+button_handlers = {}
+DISPLAY_AVAILABLE = False
+epd = False
+_init_lock = Lock()
+_initialized = False
+
+
+def init_display():
+    """Initialize and clear the e-paper display and set up the buttons.
+
+    This is done on first use and not at import time, as clearing
+    the display takes several seconds. Returns True if available.
+    """
+    global DISPLAY_AVAILABLE, epd, _initialized
+    with _init_lock:
+        if _initialized:
+            return DISPLAY_AVAILABLE
+        _initialized = True
+        try:
+            if SIMULATE:
+                from mothpi.simulation import epd2in7, Button
+            else:
+                from waveshare_epd import epd2in7
+                from gpiozero import Button  # import the Button control from gpiozero
+
+            for button_nr, pin in button_pins.items():
+                buttons[button_nr] = Button(pin)
+                if button_nr in button_handlers:
+                    buttons[button_nr].when_pressed = button_handlers[button_nr]
+
+            epd = epd2in7.EPD()  # get the display object and assing to epd
+            epd.init()  # initialize the display
+            logging.info("Clear display...")
+            epd.Clear(0xFF)  # clear the display
+
+            DISPLAY_AVAILABLE = True
+            logging.info("Display found.")
+        except:
+            logging.error("No display found!")
+            DISPLAY_AVAILABLE = False
+            epd = False
+        Epaper.is_available = DISPLAY_AVAILABLE
+        return DISPLAY_AVAILABLE
+
 
 # Handle button presses
 # param Button (passed from when_pressed)
@@ -66,36 +96,36 @@ def handle_btn_press(btn):
 
 
 class Epaper:
+    # updated by init_display()
     is_available = DISPLAY_AVAILABLE
 
+    @staticmethod
+    def init():
+        return init_display()
+
     @staticmethod
     def set_button_handler(button_nr, handler_fn):
+        """Set a button handler; also possible before the display is initialized."""
         logging.info(f"Set button {button_nr} handler to {handler_fn.__name__}")
-        if not DISPLAY_AVAILABLE:
-            return
-        if button_nr == 1:
-            btn1.when_pressed = handler_fn
-        elif button_nr == 2:
-            btn2.when_pressed = handler_fn
-        elif button_nr == 3:
-            btn3.when_pressed = handler_fn
-        elif button_nr == 4:
-            btn4.when_pressed = handler_fn
-        else:
+        if button_nr not in button_pins:
             raise ValueError(f"button_nr has to be in [1,2,3,4]! ({button_nr})")
+        button_handlers[button_nr] = handler_fn
+        if button_nr in buttons:
+            buttons[button_nr].when_pressed = handler_fn
 
     @staticmethod
+    @metrics.timed("display_refresh_seconds", "Time to refresh the e-paper")
     def display(HBlackImage: Image, cc_to=None):
         HBlackImage.save("/tmp/epaper_display.png")
         if cc_to:
             HBlackImage.save(cc_to)
-        if DISPLAY_AVAILABLE:
+        if init_display():
             epd.display(epd.getbuffer(HBlackImage))
 
     @staticmethod
     def write_string(output_string):
         logging.info(f"Display: {output_string}")
-        if not DISPLAY_AVAILABLE:
+        if not init_display():
             return
         HBlackImage = paint_simple_text_output(output_string)
         # Add the images to the display. Both the black and red layers need
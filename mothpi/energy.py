@@ -0,0 +1,171 @@
+# !/usr/bin/python3
+# -*- coding:utf-8 -*-
+
+"""
+Energy accounting for Mothpi.
+
+Estimates the energy consumption per night from the switching timeline
+of the relais (see mothpi/relais.py), the number of captures and the
+configured power draw of each device. With an energy budget per night,
+the capture interval is stretched or the lamp is switched off early,
+so that the battery lasts until sunrise.
+
+2021, Technische Universität München, Ludwig Kürzinger
+"""
+
+import datetime
+import time
+from collections import deque
+from threading import Lock
+
+# Nights are counted from noon to noon, by the date of the evening
+NIGHT_OFFSET = datetime.timedelta(hours=12)
+
+
+def get_night(timestamp):
+    """Return the date of the evening of the night of a timestamp (s)."""
+    return str((datetime.datetime.fromtimestamp(timestamp) - NIGHT_OFFSET).date())
+
+
+def relais_power(states: dict, relais_power_w: dict):
+    """Power draw (W) of the relais channels that are on."""
+    return sum(relais_power_w.get(channel, 0.0) for channel, on in states.items() if on)
+
+
+def stretched_interval(available_wh, remaining_s, capture_wh, min_interval):
+    """Capture interval (s) so that the remaining captures fit available_wh.
+
+    Returns None if not even a single capture fits.
+    """
+    if capture_wh <= 0:
+        return min_interval
+    num_captures = available_wh / capture_wh
+    if num_captures < 1:
+        return None
+    return max(min_interval, remaining_s / num_captures)
+
+
+class EnergyModel:
+    """Integrates the energy consumption (Wh) of the current night.
+
+    The relais states are tracked from the switching log; update()
+    integrates the power draw since the previous update.
+    """
+
+    def __init__(self, relais_states: dict, history_size=14):
+        self.states = dict(relais_states)
+        self.last_update = time.time()
+        self.night = get_night(self.last_update)
+        self.relais_wh = 0.0
+        self.base_wh = 0.0
+        self.captures = 0
+        # (night, consumed Wh, captures) of the previous nights
+        self.nights = deque(maxlen=history_size)
+        self._lock = Lock()
+
+    def add_captures(self, num_pictures):
+        """Count the pictures of a capture (one per camera)."""
+        with self._lock:
+            self.captures += num_pictures
+
+    def _close_night(self, night, capture_wh):
+        self.nights.append(
+            (self.night, round(self.consumed_wh(capture_wh), 2), self.captures)
+        )
+        self.night = night
+        self.relais_wh = self.base_wh = 0.0
+        self.captures = 0
+
+    def update(self, events, relais_power_w: dict, base_w, capture_wh, now=None):
+        """Integrate the power draw up to now.
+
+        events: relais switching events [(datetime, channel, state)]
+        since the previous update, in chronological order.
+        """
+        now = now or time.time()
+        with self._lock:
+            t = self.last_update
+            for timestamp, channel, state in events:
+                timestamp = min(max(timestamp.timestamp(), t), now)
+                self.relais_wh += relais_power(self.states, relais_power_w) * (
+                    (timestamp - t) / 3600
+                )
+                self.states[channel] = state
+                t = timestamp
+            self.relais_wh += relais_power(self.states, relais_power_w) * (
+                (now - t) / 3600
+            )
+            self.base_wh += base_w * (now - self.last_update) / 3600
+            self.last_update = now
+            night = get_night(now)
+            if night != self.night:
+                self._close_night(night, capture_wh)
+
+    def consumed_wh(self, capture_wh):
+        """Estimated consumption of the current night so far (Wh)."""
+        return self.relais_wh + self.base_wh + self.captures * capture_wh
+
+    def plan(
+        self,
+        budget_wh,
+        remaining_s,
+        lamp_w,
+        base_w,
+        capture_wh,
+        num_cameras,
+        capture_interval,
+        mode="interval",
+    ):
+        """Fit the rest of the night into the energy budget.
+
+        Returns a dict with the consumed and projected energy, the capture
+        interval to use and whether the lamp has to be switched off.
+        In mode "interval", the capture interval is stretched if the base
+        load and the lamp fit into the budget, but not all captures (at
+        most one capture per hour). Otherwise, the lamp stays on as long
+        as the budget covers the base load and the captures until sunrise,
+        and is switched off once this margin is used up.
+        """
+        consumed = self.consumed_wh(capture_wh)
+        hours = remaining_s / 3600
+        per_capture_wh = capture_wh * num_cameras
+        captures_wh = remaining_s / capture_interval * per_capture_wh
+        projected = consumed + hours * (base_w + lamp_w) + captures_wh
+        plan = {
+            "night": self.night,
+            "consumed_wh": round(consumed, 2),
+            "projected_wh": round(projected, 2),
+            "budget_wh": budget_wh,
+            "capture_interval": capture_interval,
+            "lamp_off": False,
+        }
+        if not budget_wh or projected <= budget_wh:
+            return plan
+        if mode == "interval":
+            interval = stretched_interval(
+                budget_wh - consumed - hours * (base_w + lamp_w),
+                remaining_s,
+                per_capture_wh,
+                capture_interval,
+            )
+            if interval is not None and interval <= 3600:
+                plan["capture_interval"] = int(interval)
+                captures_wh = remaining_s / plan["capture_interval"] * per_capture_wh
+                projected = consumed + hours * (base_w + lamp_w) + captures_wh
+                plan["projected_wh"] = round(projected, 2)
+                return plan
+        # the lamp is the deficit: run it while the margin lasts
+        margin = budget_wh - consumed - hours * base_w - captures_wh
+        plan["lamp_off"] = margin <= 0
+        lamp_hours = min(max(margin, 0.0) / lamp_w, hours) if lamp_w else hours
+        projected = consumed + hours * base_w + captures_wh + lamp_hours * lamp_w
+        plan["projected_wh"] = round(projected, 2)
+        return plan
+
+    def summary(self):
+        """Previous nights as {night: {"consumed_wh":, "captures":}}."""
+        with self._lock:
+            return {
+                night: {"consumed_wh": consumed, "captures": captures}
+                for night, consumed, captures in self.nights
+            }
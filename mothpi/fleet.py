@@ -0,0 +1,200 @@
+# !/usr/bin/python3
+# -*- coding:utf-8 -*-
+
+"""
+Mothpi fleet status.
+
+Polls the /status.json endpoint of many Mothpi units concurrently and
+aggregates their health, free disk space, age of the last picture and
+recent errors into one table or JSON file:
+
+    python3 -m mothpi.fleet --units units.txt --json fleet.json
+
+Units are given as arguments or in a file, one per line, either as
+`URL` or as `NAME URL`; lines starting with # are ignored. Units behind
+the reverse SSH tunnel (see systemd/sshtunnel.service) are reached via
+a local port forward on the server, e.g. `moth1 http://localhost:8101`.
+
+--
+2021, Technische Universität München, Ludwig Kürzinger
+"""
+
+import argparse
+import asyncio
+import json
+import sys
+import time
+from pathlib import Path
+from urllib.parse import urlsplit
+
+STATUS_PATH = "/status.json"
+
+# Columns of the table: (key, header)
+TABLE_COLUMNS = [
+    ("name", "Unit"),
+    ("state", "State"),
+    ("cameras", "Cams"),
+    ("disk_free_mb", "Free MB"),
+    ("last_picture_age", "Last pic"),
+    ("stalled_services", "Stalled"),
+    ("error", "Last error"),
+]
+
+
+def get_parser():
+    """Obtain an argument-parser for the script interface."""
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("urls", nargs="*", help="Unit URLs, e.g. http://host:8000")
+    parser.add_argument("--units", type=Path, help="File with one unit per line")
+    parser.add_argument(
+        "--concurrency", type=int, default=16, help="Maximum parallel requests"
+    )
+    parser.add_argument(
+        "--timeout", type=float, default=10.0, help="Timeout per unit (s)"
+    )
+    parser.add_argument("--json", type=Path, help="Write the results to a JSON file")
+    parser.add_argument(
+        "--stale_after",
+        type=float,
+        default=3600.0,
+        help="Warn if the last picture is older than this (s)",
+    )
+    return parser
+
+
+def load_units(urls=(), path: Path = None):
+    """Return a list of (name, url) from URLs and an optional units file."""
+    lines = list(urls)
+    if path:
+        lines += path.read_text().splitlines()
+    units = []
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        parts = line.split()
+        url = parts[-1]
+        name = parts[0] if len(parts) > 1 else urlsplit(url).netloc
+        units.append((name, url.rstrip("/")))
+    return units
+
+
+async def http_get_json(url, timeout):
+    """GET a JSON document via HTTP/1.0, without blocking the event loop."""
+    parts = urlsplit(url)
+    use_ssl = parts.scheme == "https"
+    port = parts.port or (443 if use_ssl else 80)
+    path = parts.path or "/"
+    if parts.query:
+        path += "?" + parts.query
+
+    async def get():
+        reader, writer = await asyncio.open_connection(
+            parts.hostname, port, ssl=use_ssl or None
+        )
+        try:
+            request = f"GET {path} HTTP/1.0\r\nHost: {parts.netloc}\r\n\r\n"
+            writer.write(request.encode("ascii"))
+            await writer.drain()
+            response = await reader.read()
+        finally:
+            writer.close()
+        return response
+
+    response = await asyncio.wait_for(get(), timeout)
+    head, _, body = response.partition(b"\r\n\r\n")
+    status_line = head.split(b"\r\n", 1)[0].decode("latin-1")
+    status = int(status_line.split()[1])
+    if status != 200:
+        raise ConnectionError(f"HTTP {status}")
+    return json.loads(body)
+
+
+async def poll_unit(name, url, semaphore, timeout):
+    """Poll the status of one unit; errors are recorded, not raised."""
+    result = {"name": name, "url": url}
+    async with semaphore:
+        start = time.monotonic()
+        try:
+            result["status"] = await http_get_json(url + STATUS_PATH, timeout)
+        except asyncio.TimeoutError:
+            result["error"] = f"Timeout after {timeout}s"
+        except (OSError, ValueError, IndexError) as e:
+            result["error"] = f"{type(e).__name__}: {e}"
+        result["latency"] = round(time.monotonic() - start, 3)
+    return result
+
+
+async def poll_fleet(units, concurrency=16, timeout=10.0):
+    """Poll all units with at most `concurrency` requests at once."""
+    semaphore = asyncio.Semaphore(concurrency)
+    return await asyncio.gather(
+        *(poll_unit(name, url, semaphore, timeout) for name, url in units)
+    )
+
+
+def summarize(result, stale_after=3600.0):
+    """Flatten one poll result into a table row.
+
+    The state is UNREACHABLE, FAILING (cameras missing, services stalled
+    or no recent picture) or OK.
+    """
+    row = {"name": result["name"], "url": result["url"]}
+    status = result.get("status")
+    if status is None:
+        row.update(state="UNREACHABLE", error=result.get("error", ""))
+        return row
+    age = status.get("last_picture_age")
+    stale = age is not None and age > stale_after
+    row.update(
+        state="OK" if status.get("healthy") and not stale else "FAILING",
+        cameras=f"{status.get('cameras_available')}/{status.get('cameras_total')}",
+        disk_free_mb=status.get("disk_free_mb"),
+        last_picture_age=None if age is None else int(age),
+        stalled_services=",".join(status.get("stalled_services", [])),
+        error=status["errors"][0] if status.get("errors") else "",
+    )
+    return row
+
+
+def format_table(rows):
+    """Format rows as a fixed-width text table."""
+    lines = [[header for key, header in TABLE_COLUMNS]]
+    for row in rows:
+        line = []
+        for key, header in TABLE_COLUMNS:
+            value = row.get(key)
+            line.append("-" if value is None or value == "" else str(value))
+        lines.append(line)
+    widths = [max(len(line[i]) for line in lines) for i in range(len(TABLE_COLUMNS))]
+    widths[-1] = min(widths[-1], 60)
+    return "\n".join(
+        "  ".join(
+            cell[:width].ljust(width) for cell, width in zip(line, widths)
+        ).rstrip()
+        for line in lines
+    )
+
+
+def main():
+    """Poll all units and print the table; exit code 1 if any is not OK."""
+    args = get_parser().parse_args()
+    units = load_units(args.urls, args.units)
+    if not units:
+        sys.exit("No units given.")
+    results = asyncio.run(poll_fleet(units, args.concurrency, args.timeout))
+    rows = [summarize(result, args.stale_after) for result in results]
+    print(format_table(rows))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(
+                {"time": time.time(), "units": rows, "results": results}, f, indent=2
+            )
+    sys.exit(0 if all(row["state"] == "OK" for row in rows) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+# !/usr/bin/python3
+# -*- coding:utf-8 -*-
+
+"""
+Mothpi fleet status check.
+
+Runs the fleet status poller (mothpi/fleet.py) against local stand-in
+units: the web app of a simulated Mothpi, served by waitress on ephemeral
+ports, with healthy, failing, stale, unresponsive and unreachable units.
+Runs on a normal Linux computer:
+
+    python3 -m mothpi.fleet_check
+
+The program exits with an error if a unit is not reported as expected.
+
+--
+2021, Technische Universität München, Ludwig Kürzinger
+"""
+
+import os
+
+# The simulated backends must be selected before mothpi modules are imported
+os.environ["MOTHPI_SIMULATE"] = "1"
+
+import argparse
+import asyncio
+import logging
+import socket
+import tempfile
+from pathlib import Path
+from threading import Thread
+
+from mothpi.config import config
+from mothpi.fleet import format_table, poll_fleet, summarize
+from mothpi.simulation import simulation
+
+STALE_AFTER = 3600.0
+
+
+class StandInUnit:
+    """A unit that reports the health of a Mothpi with some values changed."""
+
+    def __init__(self, mothpi, **changes):
+        self.mothpi = mothpi
+        self.changes = changes
+
+    def health_summary(self):
+        return dict(self.mothpi.health_summary(), **self.changes)
+
+
+def get_parser():
+    """Obtain an argument-parser for the script interface."""
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument(
+        "--timeout", type=float, default=2.0, help="Timeout per unit (s)"
+    )
+    parser.add_argument(
+        "--log_level",
+        type=lambda x: x.upper(),
+        default="WARNING",
+        choices=("CRITICAL", "ERROR", "WARNING", "INFO", "DEBUG", "NOTSET"),
+        help="The verbosity level of logging",
+    )
+    return parser
+
+
+def serve_standin(mothpi=None):
+    """Serve the web app for a stand-in on an ephemeral port; return the server."""
+    from waitress.server import create_server
+
+    from mothpi.app import create_app
+
+    server = create_server(create_app(mothpi), host="127.0.0.1", port=0, threads=2)
+    Thread(target=server.run, name="mothpi-standin", daemon=True).start()
+    return server
+
+
+def start_mothpi():
+    """Start a simulated Mothpi that has just taken a picture."""
+    simulation.capture_latency = 0.0
+    simulation.picture_size = (300, 200)
+    config.pictures_save_folder = tempfile.mkdtemp(prefix="mothpi-fleet-")
+    config.history_file = str(Path(tempfile.mkdtemp()) / "history.npy")
+    config.camera_worker_process = False
+    config.power_save_daylight = False
+    config.power_save_weather = False
+
+    from mothpi.mp import MothPi
+
+    mothpi = MothPi()
+    # no network access during checks
+    mothpi.weather.get_weather_dict = lambda *args, **kwargs: {}
+    mothpi.start_up()
+    return mothpi
+
+
+def run_check(timeout):
+    """Poll the stand-in units; return the table rows and the mismatches."""
+    mothpi = start_mothpi()
+    standins = {
+        "healthy": (mothpi, "OK"),
+        "camera_lost": (
+            StandInUnit(mothpi, healthy=False, cameras_available=0),
+            "FAILING",
+        ),
+        "stalled": (
+            StandInUnit(mothpi, healthy=False, stalled_services=["periodic_pictures"]),
+            "FAILING",
+        ),
+        "stale": (
+            StandInUnit(mothpi, last_picture_age=2 * STALE_AFTER),
+            "FAILING",
+        ),
+        # the web app without a running Mothpi answers 503
+        "app_only": (None, "UNREACHABLE"),
+    }
+    servers = {name: serve_standin(unit) for name, (unit, _) in standins.items()}
+    units = [
+        (name, f"http://127.0.0.1:{server.effective_port}")
+        for name, server in servers.items()
+    ]
+    expected = {name: state for name, (_, state) in standins.items()}
+    # accepts connections, but never answers
+    hanging = socket.socket()
+    hanging.bind(("127.0.0.1", 0))
+    hanging.listen()
+    units.append(("hanging", f"http://127.0.0.1:{hanging.getsockname()[1]}"))
+    expected["hanging"] = "UNREACHABLE"
+    # nothing listens on this port
+    closed = socket.socket()
+    closed.bind(("127.0.0.1", 0))
+    units.append(("down", f"http://127.0.0.1:{closed.getsockname()[1]}"))
+    expected["down"] = "UNREACHABLE"
+    try:
+        results = asyncio.run(poll_fleet(units, concurrency=3, timeout=timeout))
+    finally:
+        for server in servers.values():
+            server.close()
+        hanging.close()
+        closed.close()
+        mothpi.stop_service()
+    rows = [summarize(result, STALE_AFTER) for result in results]
+    mismatches = [
+        f"{row['name']}: {row['state']} (expected {expected[row['name']]})"
+        for row in rows
+        if row["state"] != expected[row["name"]]
+    ]
+    return rows, mismatches
+
+
+def main():
+    """Run the check, print the table and the mismatches."""
+    args = get_parser().parse_args()
+    logging.basicConfig(level=args.log_level)
+    rows, mismatches = run_check(args.timeout)
+    print(format_table(rows))
+    for mismatch in mismatches:
+        print(f"Unexpected state of {mismatch}")
+    if mismatches:
+        raise SystemExit(1)
+    print("All units reported as expected.")
+
+
+if __name__ == "__main__":
+    main()
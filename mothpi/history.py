@@ -0,0 +1,120 @@
+# !/usr/bin/python3
+# -*- coding:utf-8 -*-
+
+"""
+Status history for Mothpi.
+
+A fixed-size ring buffer of status samples (disk, weather, camera and
+relais states) in a memory-mapped NumPy file. Memory use is constant,
+appending a sample does not allocate, and the history survives restarts.
+
+Example:
+>> history = StatusHistory(config.history_file, config.history_size)
+>> history.append(time=time.time(), num_pics=12, temperature=15.0)
+>> history.downsample(start, end, num_points=200)
+
+2021, Technische Universität München, Ludwig Kürzinger
+"""
+
+import logging
+from pathlib import Path
+
+import numpy as np
+
+SAMPLE_DTYPE = np.dtype(
+    [
+        ("time", "f8"),
+        ("num_pics", "i4"),
+        ("num_free_space", "i4"),
+        ("cameras_available", "i2"),
+        ("cameras_total", "i2"),
+        ("display", "i1"),
+        ("power_save", "i1"),
+        ("relais", "u1"),
+        ("wind_speed", "f4"),
+        ("temperature", "f4"),
+    ]
+)
+
+
+def relais_bitmask(relais_states: dict):
+    """Encode {channel: is_on} as a bitmask (bit 0 is channel 1)."""
+    return sum(1 << (int(channel) - 1) for channel, on in relais_states.items() if on)
+
+
+class StatusHistory:
+    """Ring buffer of status samples in a memory-mapped .npy file."""
+
+    def __init__(self, path, size=10080, mode="r+"):
+        """Open the history file, or create it with size samples.
+
+        A file with a different layout is replaced. With mode="r",
+        the file is opened read-only (e.g., by the web app).
+        """
+        self.path = Path(path)
+        self.buffer = None
+        if self.path.is_file():
+            try:
+                self.buffer = np.load(self.path, mmap_mode=mode)
+            except (OSError, ValueError) as e:
+                logging.error(f"Cannot read status history {self.path}: {e}")
+            if self.buffer is not None and (
+                self.buffer.dtype != SAMPLE_DTYPE or self.buffer.shape != (size,)
+            ):
+                logging.warning(f"Status history {self.path} has a different layout.")
+                self.buffer = None
+        if self.buffer is None:
+            if mode == "r":
+                self.buffer = np.zeros(0, dtype=SAMPLE_DTYPE)
+            else:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                self.buffer = np.lib.format.open_memmap(
+                    self.path, mode="w+", dtype=SAMPLE_DTYPE, shape=(size,)
+                )
+        # continue after the latest sample
+        if len(self.buffer) and self.buffer["time"].max() > 0:
+            self._index = (int(self.buffer["time"].argmax()) + 1) % len(self.buffer)
+        else:
+            self._index = 0
+
+    def append(self, **sample):
+        """Write a sample into the next slot; missing fields are zero."""
+        row = self.buffer[self._index]
+        for name in SAMPLE_DTYPE.names:
+            row[name] = sample.get(name, 0)
+        self._index = (self._index + 1) % len(self.buffer)
+
+    def flush(self):
+        """Write changes to disk (otherwise done by the OS page cache)."""
+        if isinstance(self.buffer, np.memmap):
+            self.buffer.flush()
+
+    def query(self, start=None, end=None):
+        """Return the samples within [start, end] (timestamps), sorted by time."""
+        times = self.buffer["time"]
+        mask = times > 0
+        if start is not None:
+            mask &= times >= start
+        if end is not None:
+            mask &= times <= end
+        samples = np.asarray(self.buffer[mask])
+        return samples[np.argsort(samples["time"], kind="stable")]
+
+    def downsample(self, start=None, end=None, num_points=200):
+        """Average samples in num_points time bins, e.g., for charts.
+
+        Returns a dict {field: list}; empty bins are left out.
+        """
+        samples = self.query(start, end)
+        if len(samples) == 0:
+            return {name: [] for name in SAMPLE_DTYPE.names}
+        times = samples["time"]
+        edges = np.linspace(times[0], times[-1] + 1e-6, num_points + 1)
+        bins = np.searchsorted(edges, times, side="right") - 1
+        counts = np.bincount(bins, minlength=num_points)
+        filled = counts > 0
+        result = {}
+        for name in SAMPLE_DTYPE.names:
+            sums = np.bincount(bins, weights=samples[name], minlength=num_points)
+            result[name] = (sums[filled] / counts[filled]).round(3).tolist()
+        return result
@@ -0,0 +1,135 @@
+# !/usr/bin/python3
+# -*- coding:utf-8 -*-
+
+"""
+Low-write logging for Mothpi.
+
+Log records are kept in a bounded in-memory ring buffer that can be
+browsed in the web app. Records are passed on to the actual log target
+(e.g., stderr, and so the journal on the SD card) only in batches:
+when the batch is full, after a time interval, or immediately for
+warnings and errors.
+
+This unit provides a global handler ``log_buffer``, see install().
+
+2021, Technische Universität München, Ludwig Kürzinger
+"""
+
+import datetime
+import itertools
+import logging
+import time
+from collections import deque
+from logging.handlers import MemoryHandler
+from threading import Lock
+
+
+class LogBufferHandler(MemoryHandler):
+    """Ring buffer of recent records with batched flushing to a target."""
+
+    def __init__(
+        self,
+        ring_size=2000,
+        capacity=100,
+        flush_level=logging.WARNING,
+        flush_interval=300,
+        target=None,
+    ):
+        super().__init__(capacity, flushLevel=flush_level, target=target)
+        self.ring = deque(maxlen=ring_size)
+        self.flush_interval = flush_interval
+        self._last_flush = time.monotonic()
+        self._counter = itertools.count(1)
+        self._ring_lock = Lock()
+
+    def emit(self, record):
+        entry = {
+            "id": next(self._counter),
+            "time": datetime.datetime.fromtimestamp(record.created).isoformat(" "),
+            "level": record.levelname,
+            "levelno": record.levelno,
+            "module": record.module,
+            "lineno": record.lineno,
+            "message": record.getMessage(),
+        }
+        with self._ring_lock:
+            self.ring.append(entry)
+        super().emit(record)
+
+    def shouldFlush(self, record):
+        if time.monotonic() - self._last_flush > self.flush_interval:
+            return True
+        return super().shouldFlush(record)
+
+    def flush(self):
+        self._last_flush = time.monotonic()
+        super().flush()
+
+    def get_records(self, page=1, per_page=100, min_level=logging.NOTSET):
+        """Return one page of records, newest first, and the number of pages."""
+        with self._ring_lock:
+            records = [r for r in self.ring if r["levelno"] >= min_level]
+        records.reverse()
+        num_pages = max(1, -(-len(records) // per_page))
+        start = (page - 1) * per_page
+        return records[start : start + per_page], num_pages
+
+
+# This sets the global log buffer; it is installed with install()
+log_buffer = LogBufferHandler()
+
+
+def install(logger: logging.Logger, ring_size=2000, capacity=100, flush_interval=300):
+    """Route all handlers of the logger through the log buffer.
+
+    The existing handlers become the flush targets of the buffer.
+    """
+    targets = [h for h in logger.handlers if h is not log_buffer]
+    for handler in targets:
+        logger.removeHandler(handler)
+    if len(targets) == 1:
+        target = targets[0]
+    else:
+        target = _MultiHandler(targets)
+    log_buffer.ring = deque(log_buffer.ring, maxlen=ring_size)
+    log_buffer.capacity = capacity
+    log_buffer.flush_interval = flush_interval
+    log_buffer.setTarget(target)
+    logger.addHandler(log_buffer)
+    return log_buffer
+
+
+class _MultiHandler(logging.Handler):
+    """Pass records on to several handlers."""
+
+    def __init__(self, handlers):
+        super().__init__()
+        self.handlers = handlers
+
+    def handle(self, record):
+        for handler in self.handlers:
+            if record.levelno >= handler.level:
+                handler.handle(record)
+        return True
+
+    def flush(self):
+        for handler in self.handlers:
+            handler.flush()
+
+
+def setup_process_logging(level=logging.INFO):
+    """Log directly to stderr in a child process (e.g., the camera worker).
+
+    Child processes do not use the log buffer, as nothing flushes it there.
+    """
+    logger = logging.getLogger()
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    handler = logging.StreamHandler()
+    handler.setFormatter(
+        logging.Formatter(
+            "%(processName)s (%(module)s:%(lineno)d) %(levelname)s: %(message)s"
+        )
+    )
+    logger.addHandler(handler)
+    logger.setLevel(level)
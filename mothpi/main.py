@@ -12,9 +12,14 @@ https://visammod.vision.in.tum.de/
 
 import logging
 import argparse
+import os
 import systemd.daemon
 import time
+from threading import Thread
+from mothpi.config import config
+from mothpi.logbuffer import install as install_log_buffer
 from mothpi.mp import MothPi
+from mothpi.utils import Periodic
 
 
 def get_parser():
@@ -46,25 +51,73 @@ def get_parser():
     return parser
 
 
+def get_watchdog_interval():
+    """Return the interval to notify the systemd watchdog (s), or None.
+
+    systemd sets WATCHDOG_USEC if WatchdogSec= is configured for the unit;
+    notifications are sent at half of this time.
+    """
+    watchdog_usec = os.environ.get("WATCHDOG_USEC")
+    if not watchdog_usec:
+        return None
+    return int(watchdog_usec) / 1e6 / 2
+
+
+def notify_watchdog(mothpi: MothPi):
+    """Notify the systemd watchdog, but only if no job is stalled."""
+    stalled = mothpi.stalled_services()
+    if stalled:
+        logging.error(f"Watchdog: jobs stalled: {stalled}")
+    else:
+        systemd.daemon.notify("WATCHDOG=1")
+
+
+def serve_app(app, port, threads=4):
+    """Serve the web app with a threaded WSGI server.
+
+    Waitress is used if installed, otherwise the threaded
+    Flask development server.
+    """
+    try:
+        from waitress import serve
+    except ImportError:
+        logging.warning("Waitress not found, using the Flask development server.")
+        app.run(host="0.0.0.0", port=port, threaded=True)
+        return
+    serve(app, host="0.0.0.0", port=port, threads=threads)
+
+
 def main():
     """Main function of mothpi.
 
     This function starts the Mothpi program, and, if configured,
-    opens the web interface.
+    opens the web interface in a separate thread.
 
     Also, if Mothpi is configured to run as a systemd service, it sends the
-    READY signal.
+    READY signal, at the latest after the configured startup budget.
     """
     # Initialize
     parser = get_parser()
     args = parser.parse_args()
     logger = logging.getLogger()
     logger.setLevel(args.log_level)
-    formatter = logging.Formatter("(%(module)s:%(lineno)d) %(levelname)s: %(message)s")
+    # records are written in batches, so the time of the event is logged
+    formatter = logging.Formatter(
+        "%(asctime)s (%(module)s:%(lineno)d) %(levelname)s: %(message)s"
+    )
     logger.handlers[0].setFormatter(formatter)
+    # keep recent messages in memory, write them to the journal in batches
+    log_buffer = install_log_buffer(
+        logger,
+        ring_size=config.log_ring_size,
+        capacity=config.log_batch_size,
+        flush_interval=config.log_flush_interval,
+    )
 
+    start = time.monotonic()
     # Set up Mothpi
     mothpi = MothPi()
+    logging.info(f"Startup phase init: {time.monotonic() - start:.2f}s")
 
     # if needed, start web interface
     if args.app:
@@ -72,12 +125,36 @@ def main():
 
         port = args.port
         logging.info(f"Starting web app on port {port}.")
-        create_app().run(host="0.0.0.0", port=port)
+        app_thread = Thread(
+            target=serve_app,
+            args=(create_app(mothpi), port),
+            name="mothpi-app",
+            daemon=True,
+        )
+        app_thread.start()
+
+    # set up the hardware in the background
+    mothpi.start_up(budget=config.startup_budget)
 
     # Systemd service notification
     # https://github.com/torfsen/python-systemd-tutorial
     systemd.daemon.notify("READY=1")
-    logging.info("Ready.")
+    logging.info(f"Ready after {time.monotonic() - start:.2f}s.")
+
+    mothpi.services["log_flush"] = Periodic(
+        interval=config.log_flush_interval,
+        function=log_buffer.flush,
+        autostart=False,
+    )
+    watchdog_interval = get_watchdog_interval()
+    if watchdog_interval:
+        logging.info(f"Watchdog enabled, interval {watchdog_interval}s.")
+        mothpi.services["watchdog"] = Periodic(
+            interval=watchdog_interval,
+            function=notify_watchdog,
+            mothpi=mothpi,
+            autostart=False,
+        )
 
     try:
         mothpi.serve()
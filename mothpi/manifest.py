@@ -0,0 +1,160 @@
+# !/usr/bin/python3
+# -*- coding:utf-8 -*-
+
+"""
+Nightly capture manifest for Mothpi.
+
+During the night, a record for each saved picture is appended to a small
+journal (filename, timestamp, size, checksum, camera id, weather,
+sunshine and relais state). At dawn, the records are written as one
+columnar file into the pictures folder, so that it is uploaded together
+with the pictures and can be ingested with a single bulk read.
+
+Parquet and Arrow IPC files need pyarrow; otherwise, CSV is written.
+
+2021, Technische Universität München, Ludwig Kürzinger
+"""
+
+import csv
+import datetime
+import hashlib
+import json
+import logging
+from pathlib import Path
+from threading import Lock
+
+try:
+    import pyarrow as pa
+
+    PYARROW_IS_AVAILABLE = True
+except ImportError:
+    PYARROW_IS_AVAILABLE = False
+
+MANIFEST_FOLDER_NAME = "manifest"
+
+# Columns and their Arrow types
+MANIFEST_FIELDS = {
+    "filename": "string",
+    "timestamp": "timestamp",
+    "camera_time": "timestamp",
+    "size": "int64",
+    "sha256": "string",
+    "camera_id": "string",
+    "wind_speed": "float32",
+    "temperature": "float32",
+    "sunshine": "bool",
+    "relais": "uint8",
+}
+
+
+def file_checksum(path, chunk_size=1024 * 1024):
+    """Return the SHA-256 hex digest of a file."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class NightManifest:
+    """Collect picture records of a night and export them at dawn."""
+
+    def __init__(self, pictures_folder):
+        self.pictures_folder = Path(pictures_folder)
+        folder = self.pictures_folder / MANIFEST_FOLDER_NAME
+        folder.mkdir(parents=True, exist_ok=True)
+        # the journal keeps the records of the night across restarts
+        self.journal_path = folder / "pending.jsonl"
+        # the records being exported; kept if the export fails
+        self.export_path = folder / "exporting.jsonl"
+        self._lock = Lock()
+
+    def add(self, path, **record):
+        """Add a record for the picture file at path.
+
+        Size and checksum are determined from the file.
+        """
+        path = Path(path)
+        record["filename"] = path.name
+        record["size"] = path.stat().st_size
+        record["sha256"] = file_checksum(path)
+        with self._lock:
+            with open(self.journal_path, "a") as f:
+                f.write(json.dumps(record) + "\n")
+
+    @staticmethod
+    def _read(path):
+        if not path.is_file():
+            return []
+        with open(path, "r") as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+    def records(self):
+        """Return the pending records."""
+        with self._lock:
+            return self._read(self.export_path) + self._read(self.journal_path)
+
+    def _take_journal(self):
+        """Move the journal aside; later records go to a new journal."""
+        with self._lock:
+            if not self.journal_path.is_file():
+                return
+            if self.export_path.is_file():
+                # left over from a failed export
+                with open(self.export_path, "a") as f:
+                    f.write(self.journal_path.read_text())
+                self.journal_path.unlink()
+            else:
+                self.journal_path.replace(self.export_path)
+
+    def write(self, file_format="parquet"):
+        """Write the pending records as manifest file and clear the journal.
+
+        The file is named after the evening of the night of the last record;
+        pictures saved during the export go into the next manifest.
+        Returns the path of the manifest file, or None without records.
+        """
+        self._take_journal()
+        records = self._read(self.export_path)
+        if not records:
+            return None
+        last = datetime.datetime.fromtimestamp(records[-1]["timestamp"])
+        night = (last - datetime.timedelta(hours=12)).date()
+        if file_format in ["parquet", "arrow"] and not PYARROW_IS_AVAILABLE:
+            logging.warning("pyarrow not available, writing the manifest as CSV.")
+            file_format = "csv"
+        path = self.pictures_folder / f"manifest_{night}.{file_format}"
+        if file_format == "csv":
+            self._write_csv(records, path)
+        else:
+            self._write_arrow(records, path, file_format)
+        self.export_path.unlink()
+        logging.info(f"Wrote manifest {path} with {len(records)} pictures.")
+        return path
+
+    @staticmethod
+    def _write_csv(records, path):
+        with open(path, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=list(MANIFEST_FIELDS))
+            writer.writeheader()
+            for record in records:
+                writer.writerow({key: record.get(key) for key in MANIFEST_FIELDS})
+
+    @staticmethod
+    def _write_arrow(records, path, file_format):
+        columns = {}
+        for key, arrow_type in MANIFEST_FIELDS.items():
+            values = [record.get(key) for record in records]
+            if arrow_type == "timestamp":
+                values = [None if v is None else int(v * 1000) for v in values]
+                columns[key] = pa.array(values, type=pa.timestamp("ms", tz="UTC"))
+            else:
+                columns[key] = pa.array(values, type=pa.type_for_alias(arrow_type))
+        table = pa.table(columns)
+        if file_format == "parquet":
+            import pyarrow.parquet as pq
+
+            pq.write_table(table, path)
+        else:
+            with pa.ipc.new_file(path, table.schema) as writer:
+                writer.write_table(table)
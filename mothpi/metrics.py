@@ -0,0 +1,232 @@
+# !/usr/bin/python3
+# -*- coding:utf-8 -*-
+
+"""
+Lightweight metrics for Mothpi.
+
+This unit provides a global object ``metrics`` with counters and latency
+histograms, e.g., for capture, download, display refresh or status polls.
+The metrics are exported in the Prometheus text format and summarized
+in the status of the device.
+
+Example:
+>> @metrics.timed("camera_capture_seconds", "Capture time of the camera")
+>> def capture(): ...
+>> with metrics.timed("weather_fetch_seconds"): ...
+>> metrics.counter("pictures_saved_total").inc()
+
+2021, Technische Universität München, Ludwig Kürzinger
+"""
+
+import functools
+import time
+from threading import Lock
+
+# Histogram bucket limits in seconds (plus +Inf)
+DEFAULT_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class Counter:
+    """A monotonically increasing counter."""
+
+    kind = "counter"
+
+    def __init__(self, name, description=""):
+        self.name = name
+        self.description = description
+        self.value = 0
+        self._lock = Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def reset(self):
+        with self._lock:
+            self.value = 0
+
+    def state(self):
+        return {"kind": self.kind, "help": self.description, "value": self.value}
+
+
+class Histogram:
+    """A histogram with fixed buckets, e.g., for latencies in seconds."""
+
+    kind = "histogram"
+
+    def __init__(self, name, description="", buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.description = description
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.max = 0.0
+        self._lock = Lock()
+
+    def observe(self, value):
+        index = len(self.buckets)
+        for i, limit in enumerate(self.buckets):
+            if value <= limit:
+                index = i
+                break
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.max = max(self.max, value)
+
+    def reset(self):
+        with self._lock:
+            self.counts = [0] * (len(self.buckets) + 1)
+            self.sum = 0.0
+            self.max = 0.0
+
+    def state(self):
+        with self._lock:
+            return {
+                "kind": self.kind,
+                "help": self.description,
+                "buckets": self.buckets,
+                "counts": list(self.counts),
+                "sum": self.sum,
+                "max": self.max,
+            }
+
+
+class _Timer:
+    """Context manager and decorator that observes the elapsed time."""
+
+    def __init__(self, histogram: Histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self._start)
+        return False
+
+    def __call__(self, function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.histogram.observe(time.perf_counter() - start)
+
+        return wrapper
+
+
+class MetricsRegistry:
+    """Registry of all counters and histograms.
+
+    Metrics of other processes (e.g., the camera worker) can be added
+    as remote states; they are merged into the output.
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._remote = {}
+        self._lock = Lock()
+
+    def _get(self, cls, name, description, **kwargs):
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = cls(name, description, **kwargs)
+            return self._metrics[name]
+
+    def counter(self, name, description="") -> Counter:
+        return self._get(Counter, name, description)
+
+    def histogram(self, name, description="", buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self._get(Histogram, name, description, buckets=buckets)
+
+    def timed(self, name, description=""):
+        """Time a block or function into the histogram name."""
+        return _Timer(self.histogram(name, description))
+
+    def reset(self):
+        """Set all local metrics to zero, e.g., in a new child process.
+
+        The metric objects are kept, as timed functions refer to them.
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+            self._remote = {}
+        for metric in metrics:
+            metric.reset()
+
+    def state(self):
+        """Return the state of all local metrics as a dict (picklable)."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return {metric.name: metric.state() for metric in metrics}
+
+    def set_remote(self, source, state: dict):
+        """Replace the metrics state received from another process."""
+        with self._lock:
+            self._remote[source] = state
+
+    def merged_state(self):
+        """Local and remote metrics; metrics with the same name are added."""
+        merged = self.state()
+        with self._lock:
+            remote_states = list(self._remote.values())
+        for remote in remote_states:
+            for name, state in remote.items():
+                if name not in merged:
+                    merged[name] = state
+                elif state["kind"] == "counter":
+                    merged[name] = dict(merged[name])
+                    merged[name]["value"] += state["value"]
+                elif merged[name]["buckets"] == state["buckets"]:
+                    local = merged[name]
+                    merged[name] = dict(
+                        local,
+                        counts=[
+                            a + b for a, b in zip(local["counts"], state["counts"])
+                        ],
+                        sum=local["sum"] + state["sum"],
+                        max=max(local["max"], state["max"]),
+                    )
+        return merged
+
+    def summary(self):
+        """Short summary for the status: counts, averages and maxima."""
+        summary = {}
+        for name, state in sorted(self.merged_state().items()):
+            if state["kind"] == "counter":
+                summary[name] = state["value"]
+            else:
+                count = sum(state["counts"])
+                summary[name] = {
+                    "count": count,
+                    "avg": round(state["sum"] / count, 3) if count else None,
+                    "max": round(state["max"], 3),
+                }
+        return summary
+
+    def render_prometheus(self):
+        """Return all metrics in the Prometheus text exposition format."""
+        lines = []
+        for name, state in sorted(self.merged_state().items()):
+            name = f"mothpi_{name}"
+            if state["help"]:
+                lines.append(f"# HELP {name} {state['help']}")
+            lines.append(f"# TYPE {name} {state['kind']}")
+            if state["kind"] == "counter":
+                lines.append(f"{name} {state['value']}")
+                continue
+            cumulative = 0
+            limits = [str(limit) for limit in state["buckets"]] + ["+Inf"]
+            for limit, count in zip(limits, state["counts"]):
+                cumulative += count
+                lines.append(f'{name}_bucket{{le="{limit}"}} {cumulative}')
+            lines.append(f"{name}_sum {state['sum']}")
+            lines.append(f"{name}_count {cumulative}")
+        return "\n".join(lines) + "\n"
+
+
+# This sets the global object for metrics
+metrics = MetricsRegistry()
@@ -10,24 +10,36 @@ This unit provides the main control module.
 2021, Technische Universität München, Ludwig Kürzinger
 """
 
-
 import datetime
 import queue
 import logging
+import shutil
+import socket
 import time
+from threading import Thread
 from pathlib import Path
 from typing import Union
 
 # Mothpi imports
-import gphoto2 as gp
-from mothpi.camera import MothCamera
-from mothpi.relais import Relais
+from mothpi.camera import CameraGroup
+from mothpi.camera_worker import CameraWorker
+from mothpi.relais import Relais, relais_states
+from mothpi.bus import HardwareBus
+from mothpi.bus import PRIORITY_CAPTURE, PRIORITY_DOWNLOAD, PRIORITY_RELAIS
+from mothpi.bus import PRIORITY_BUTTON, PRIORITY_MAINTENANCE, PRIORITY_STATUS
 from mothpi.display import Epaper, paint_status_page, paint_simple_text_output
 from mothpi.config import config
+from mothpi.metrics import metrics
+from mothpi.logbuffer import log_buffer
+from mothpi.history import StatusHistory, relais_bitmask
+from mothpi import postprocess
+from mothpi.manifest import NightManifest
+from mothpi.energy import EnergyModel, relais_power
+from mothpi.trigger import EventTrigger
 from mothpi.utils import Periodic, reboot
 from mothpi.utils import is_disk_full, get_disk_free_capacity
 from mothpi.utils import get_ip_addresses
-from mothpi.weather import Weather, is_sunshine
+from mothpi.weather import Weather, is_sunshine, get_next_sunrise
 
 
 class MothPi:
@@ -39,18 +51,33 @@ class MothPi:
     Furthermore, it contains several status functions that determine the
     behaviour during daytime, or regular device restarts, ...
 
-    The timers are initialized with this module, and started with serve().
+    The timers are initialized with this module, the hardware is set up
+    in the background with start_up(), and the timers are started with serve().
     """
 
     state_queue = queue.Queue()
     pictures_queue = queue.Queue()
-    camera = MothCamera()
-    epaper_available = Epaper.is_available
     services = {}
     started_on = datetime.datetime.now()
 
     def __init__(self):
-        """Initialize the module, set up periodic timers and reset the relays."""
+        """Initialize the module and set up periodic timers.
+
+        This does not access any hardware; see start_up().
+        """
+        camera_kwargs = {
+            "autodetect": config.camera_autodetect,
+            "backoff_min": config.cam_health_interval,
+            "backoff_max": config.cam_reconnect_backoff_max,
+            "settings": config.camera_settings,
+            "sync_clock": config.camera_clock_sync,
+        }
+        if config.camera_worker_process:
+            self.camera = CameraWorker(**camera_kwargs)
+        else:
+            self.camera = CameraGroup(**camera_kwargs)
+        # all hardware access is serialized over the bus
+        self.bus = HardwareBus(["camera", "relais", "display"])
         self.services["periodic_pictures"] = Periodic(
             interval=config.capture_interval,
             function=self.take_pictures,
@@ -61,49 +88,165 @@ class MothPi:
             function=self.poll_status,
             autostart=False,
         )
+        self.services["periodic_camera_health"] = Periodic(
+            interval=config.cam_health_interval,
+            function=self.check_camera_health,
+            autostart=False,
+        )
+        self.services["config_watch"] = Periodic(
+            interval=config.config_watch_interval,
+            function=config.reload_if_changed,
+            autostart=False,
+        )
+        config.add_change_listener(self.apply_config_changes)
         self.status_dict = {
             "camera": self.camera.is_available,
             "display": Epaper.is_available,
             "up_since": datetime.datetime.now(),
             "last_picture": "No photo yet!",
         }
-        # initialize GPIOs
-        self.set_relais()
         self.status_dict["buttons"] = {1: "-", 2: "-", 3: "-", 4: "-"}
         self.status_dict["buttons"][1] = "Status"
         self.status_dict["buttons"][2] = "CamReconnect"
         self.status_dict["buttons"][3] = "Reboot"
-        Epaper.set_button_handler(1, self.poll_status)
-        Epaper.set_button_handler(2, self.camera.reconnect)
-        Epaper.set_button_handler(3, reboot)
+        Epaper.set_button_handler(1, self.request_status)
+        Epaper.set_button_handler(2, self.request_camera_reconnect)
+        Epaper.set_button_handler(3, self.request_reboot)
+        self.trigger = EventTrigger(
+            pin=config.trigger_pin,
+            pull_up=config.trigger_pull_up,
+            debounce=config.trigger_debounce,
+            min_spacing=config.trigger_min_spacing,
+            max_per_hour=config.trigger_max_per_hour,
+        )
+        self.trigger.set_handler(self.request_triggered_capture)
         # Utilities
         self.weather = Weather()
-        self.weather.update_weather(lat=config.lat, lon=config.lon)
+        self.history = StatusHistory(config.history_file, config.history_size)
+        self.manifest = NightManifest(config.pictures_save_folder)
+        # the manifest is written at the next dawn, not on a daytime start
+        self._was_sunshine = is_sunshine(lat=config.lat, lon=config.lon)
+        self.energy = EnergyModel(relais_states)
+        self.energy_plan = {}
+        self.startup_timings = {}
+
+    def _timed(self, phase, function):
+        start = time.monotonic()
+        try:
+            function()
+        except Exception:
+            logging.exception(f"Startup phase {phase} failed")
+        self.startup_timings[phase] = round(time.monotonic() - start, 3)
+        logging.info(f"Startup phase {phase}: {self.startup_timings[phase]}s")
+
+    def _start_up(self):
+        """Set up the hardware in parallel, then run capture and status once."""
+        phases = {
+            "relais": self.set_relais,
+            "display": Epaper.init,
+            "trigger": self.trigger.init,
+            "camera": self.refresh_camera,
+            "weather": lambda: self.weather.update_weather(
+                lat=config.lat, lon=config.lon
+            ),
+        }
+        threads = [
+            Thread(target=self._timed, args=(phase, function), daemon=True)
+            for phase, function in phases.items()
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
         # execute the services once to make sure they work:
-        self.refresh_camera()
-        self.poll_status()
-        self.take_pictures()
-        self.poll_status()
+        self._timed("first_capture", self.take_pictures)
+        self._timed("first_status", self.poll_status)
+        self.status_dict["display"] = self.epaper_available
+        self.status_dict["startup_timings"] = self.startup_timings
+
+    def start_up(self, budget=None):
+        """Start the hardware setup in the background.
+
+        Waits at most budget seconds for it to complete; returns True
+        if the setup was completed within that time.
+        """
+        start = time.monotonic()
+        thread = Thread(target=self._start_up, name="mothpi-startup", daemon=True)
+        thread.start()
+        thread.join(budget)
+        if thread.is_alive():
+            logging.warning(f"Startup not complete after {budget}s, continuing.")
+        logging.info(
+            f"Startup: {time.monotonic() - start:.2f}s, {self.startup_timings}"
+        )
+        return not thread.is_alive()
 
     def set_relais(self, state="on"):
         """Set the relays into a certain state.
 
         Valid states: "on" or "off".
         """
-        power_save_mode = self.power_save_mode
-        if state == "on" and not power_save_mode:
-            for item in config.relais_conf:
-                if config.relais_conf[item]:
-                    Relais.set_on(item)
-                else:
-                    Relais.set_off(item)
-        elif state == "on" and power_save_mode:
-            Relais.reset()
-        elif state == "off":
+        self.bus.call(
+            "relais", "set_relais", self._set_relais, state, priority=PRIORITY_RELAIS
+        )
+
+    def _set_relais(self, state):
+        if state == "on" and not self.power_save_mode and not self.energy_lamp_off:
+            Relais.apply(config.relais_conf)
+        elif state in ["on", "off"]:
             Relais.reset()
         else:
             logging.error(f"No valid relais state: {state}")
 
+    def apply_config_changes(self, changed: set):
+        """Apply configuration changes to the running jobs and devices.
+
+        Called on config changes from the web app or the config file.
+        """
+        logging.info(f"Applying configuration changes: {sorted(changed)}")
+        intervals = {
+            "periodic_pictures": self.get_capture_interval(),
+            "periodic_status": config.polling_interval,
+            "periodic_camera_health": config.cam_health_interval,
+            "config_watch": config.config_watch_interval,
+        }
+        for name, interval in intervals.items():
+            if self.services[name].interval != interval:
+                self.services[name].reschedule(interval)
+        relais_keys = {
+            "relais_conf",
+            "power_save_daylight",
+            "power_save_weather",
+            "use_weather_data",
+        }
+        if changed & {"lat", "lon"}:
+            self.weather.update_weather(lat=config.lat, lon=config.lon)
+        if changed & (relais_keys | {"lat", "lon"}):
+            self.set_relais()
+        trigger_keys = {
+            "trigger_pin",
+            "trigger_pull_up",
+            "trigger_debounce",
+            "trigger_min_spacing",
+            "trigger_max_per_hour",
+        }
+        if changed & trigger_keys:
+            self.trigger.pin = config.trigger_pin
+            self.trigger.pull_up = config.trigger_pull_up
+            self.trigger.debounce = config.trigger_debounce
+            self.trigger.min_spacing = config.trigger_min_spacing
+            self.trigger.max_per_hour = config.trigger_max_per_hour
+            if changed & {"trigger_pin", "trigger_pull_up", "trigger_debounce"}:
+                self.trigger.init()
+        if "camera_settings" in changed:
+            self.bus.submit(
+                "camera",
+                "apply_settings",
+                self.camera.apply_settings,
+                config.camera_settings,
+                priority=PRIORITY_MAINTENANCE,
+            )
+
     def serve(self):
         """Start all timers."""
         for service in self.services.values():
@@ -113,22 +256,99 @@ class MothPi:
         """Stop all timers."""
         for service in self.services.values():
             service.stop()
+        self.trigger.close()
         self.set_relais("off")
+        self.bus.call("camera", "close", self.camera.close)
+        self.bus.stop()
+        postprocess.shutdown()
+        self.history.flush()
         time.sleep(1)
 
+    def stalled_services(self, threshold=None):
+        """Return the names of watched jobs that missed their deadline."""
+        if threshold is None:
+            threshold = config.watchdog_stall_threshold
+        watched = ["periodic_pictures", "periodic_status"]
+        return [name for name in watched if self.services[name].is_stalled(threshold)]
+
+    def health_summary(self):
+        """Return a compact, JSON-serializable health summary of this unit.
+
+        This is served as /status.json by the web app and collected
+        from all units by mothpi/fleet.py.
+        """
+        cameras = self.camera.availability()
+        stalled = self.stalled_services()
+        total, used, free = shutil.disk_usage(config.pictures_save_folder)
+        last_picture_time = self.status_dict.get("last_picture_time")
+        errors = log_buffer.get_records(per_page=5, min_level=logging.ERROR)[0]
+        return {
+            "hostname": socket.gethostname(),
+            "time": time.time(),
+            "up_since": self.status_dict["up_since"].isoformat(timespec="seconds"),
+            "healthy": bool(cameras) and all(cameras.values()) and not stalled,
+            "cameras_available": sum(cameras.values()),
+            "cameras_total": len(cameras),
+            "stalled_services": stalled,
+            "num_pics": self.status_dict.get("num_pics"),
+            "disk_free_mb": free // (1000 * 1000),
+            "disk_used_percent": round(100 * used / total, 1),
+            "last_picture_age": (
+                time.time() - last_picture_time if last_picture_time else None
+            ),
+            "errors": [f"{record['time']} {record['message']}" for record in errors],
+        }
+
+    def request_status(self):
+        """Queue a status update (e.g., on button press) without waiting."""
+        self.bus.submit(
+            "display",
+            "poll_status",
+            self._poll_status,
+            priority=PRIORITY_STATUS,
+            coalesce=True,
+        )
+
     def poll_status(self):
         """Self-check that prints a status message to the display,
         and also stores the output image in a file that can be
         uploaded to a server.
         """
+        self.bus.call(
+            "display",
+            "poll_status",
+            self._poll_status,
+            priority=PRIORITY_STATUS,
+            coalesce=True,
+        )
+
+    @metrics.timed("poll_status_seconds", "Time for a status poll")
+    def _poll_status(self):
+        postprocess.prune_originals(
+            config.pictures_save_folder, config.originals_min_free_mb * 1000 * 1000
+        )
         self.status_dict["camera"] = self.camera.is_available
-        self.status_dict["display"] = Epaper.is_available
+        self.status_dict["cameras"] = self.camera.availability()
+        self.status_dict["camera_health"] = self.camera.health()
+        self.status_dict["camera_clock_offset"] = self.camera.clock_offsets()
+        if isinstance(self.camera, CameraWorker):
+            self.status_dict["camera_worker_restarts"] = self.camera.restart_count
+        self.status_dict["display"] = self.epaper_available
         self.status_dict["num_pics"] = config.get_num_stored_pictures()
         self.status_dict["num_free_space"] = get_disk_free_capacity(
             config.pictures_save_folder
         )
         self.status_dict["poll_time"] = datetime.datetime.now()
+        self.status_dict["stalled_services"] = self.stalled_services()
+        self.status_dict["bus_latency"] = self.bus.latency()
+        self.status_dict["relais"] = Relais.read_state()
+        self.status_dict["metrics"] = metrics.summary()
         self.status_dict["IP_addresses"] = get_ip_addresses()
+        self.update_energy()
+        self.status_dict["energy"] = self.energy_plan
+        self.status_dict["energy_nights"] = self.energy.summary()
+        self.record_history()
+        self.export_manifest_at_dawn()
         # text generation
         display_lines = []
         if "last_picture" in self.status_dict:
@@ -137,7 +357,8 @@ class MothPi:
             self.status_dict["num_pics"] + self.status_dict["num_free_space"]
         )
         display_lines += [f"Disk #{self.status_dict['num_pics']}/{num_total_pics}"]
-        camera_str = "OK" if self.status_dict["camera"] else "??"
+        cameras = self.status_dict["cameras"]
+        camera_str = f"{sum(cameras.values())}/{len(cameras)}" if cameras else "??"
         display_str = "OK" if self.status_dict["display"] else "??"
         display_lines += [f"Cam~{camera_str} Disp~{display_str}"]
         ips = get_ip_addresses()
@@ -158,36 +379,258 @@ class MothPi:
             self.stop_service()
             reboot()
 
-    def take_pictures(self):
+    def request_reboot(self):
+        """Queue a reboot (e.g., on button press), shown on the display."""
+        self.bus.submit("display", "reboot", reboot, priority=PRIORITY_BUTTON)
+
+    def record_history(self):
+        """Append the current status to the status history."""
+        cameras = self.status_dict["cameras"]
+        self.history.append(
+            time=time.time(),
+            num_pics=self.status_dict["num_pics"],
+            num_free_space=self.status_dict["num_free_space"],
+            cameras_available=sum(cameras.values()),
+            cameras_total=len(cameras),
+            display=self.status_dict["display"],
+            power_save=self.power_save_mode,
+            relais=relais_bitmask(self.status_dict["relais"]),
+            wind_speed=self.weather.current_weather["wind_speed"],
+            temperature=self.weather.current_weather["temperature"],
+        )
+
+    def get_capture_interval(self):
+        """Capture interval (s), possibly stretched to fit the energy budget."""
+        return max(config.capture_interval, self.energy_plan.get("capture_interval", 0))
+
+    def update_energy(self):
+        """Account the energy consumption and fit the night into the budget.
+
+        Depending on energy_budget_mode, the capture interval is stretched
+        or the lamp is switched off until sunrise.
+        """
+        now = time.time()
+        since = datetime.datetime.fromtimestamp(self.energy.last_update)
+        self.energy.update(
+            Relais.get_switching_log(since=since),
+            config.relais_power_w,
+            config.base_power_w,
+            config.capture_energy_wh,
+            now=now,
+        )
+        was_lamp_off = self.energy_lamp_off
+        # built completely before it is shared with the other threads
+        plan = {}
+        if config.energy_budget_wh and not is_sunshine(lat=config.lat, lon=config.lon):
+            sunrise = get_next_sunrise(lat=config.lat, lon=config.lon)
+            if sunrise:
+                plan = self.energy.plan(
+                    budget_wh=config.energy_budget_wh,
+                    remaining_s=sunrise.timestamp() - now,
+                    lamp_w=relais_power(config.relais_conf, config.relais_power_w),
+                    base_w=config.base_power_w,
+                    capture_wh=config.capture_energy_wh,
+                    num_cameras=max(1, len(self.camera.availability())),
+                    capture_interval=config.capture_interval,
+                    mode=config.energy_budget_mode,
+                )
+        if not plan:
+            plan = {
+                "night": self.energy.night,
+                "consumed_wh": round(
+                    self.energy.consumed_wh(config.capture_energy_wh), 2
+                ),
+            }
+        self.energy_plan = plan
+        capture_interval = self.get_capture_interval()
+        if self.services["periodic_pictures"].interval != capture_interval:
+            logging.info(f"Energy budget: capture interval {capture_interval}s")
+            self.services["periodic_pictures"].reschedule(capture_interval)
+        if self.energy_lamp_off != was_lamp_off:
+            logging.info(f"Energy budget: lamp off {not was_lamp_off}")
+            self.set_relais()
+
+    def export_manifest_at_dawn(self):
+        """Write the manifest of the night when daylight begins."""
+        sunshine = is_sunshine(lat=config.lat, lon=config.lon)
+        if sunshine and not self._was_sunshine:
+            try:
+                self.manifest.write(config.manifest_format)
+            except Exception:
+                logging.exception("Writing the manifest failed")
+        self._was_sunshine = sunshine
+
+    def get_manifest_record(self, capture):
+        """Return the manifest record of a capture (without file information)."""
+        return {
+            "timestamp": capture.timestamp,
+            "camera_time": capture.camera_time,
+            "camera_id": getattr(capture.camera, "camera_id", capture.camera),
+            "wind_speed": self.weather.current_weather["wind_speed"],
+            "temperature": self.weather.current_weather["temperature"],
+            "sunshine": is_sunshine(lat=config.lat, lon=config.lon),
+            "relais": relais_bitmask(Relais.read_state()),
+        }
+
+    def add_to_manifest(self, path, record):
+        try:
+            self.manifest.add(path, **record)
+        except OSError as e:
+            logging.error(f"Manifest: cannot add {path}: {e}")
+
+    def request_triggered_capture(self, trigger_time):
+        """Queue a capture on a signal of the event trigger.
+
+        Returns False if no capture is queued (e.g., in power save mode).
+        """
+        if self.power_save_mode:
+            return False
+        future = self.bus.submit(
+            "camera",
+            "triggered_capture",
+            self.take_pictures,
+            trigger_time=trigger_time,
+            priority=PRIORITY_CAPTURE,
+            coalesce=True,
+        )
+        future.add_done_callback(lambda future: self.trigger.release())
+        return True
+
+    @metrics.timed("take_pictures_seconds", "Time for capture, download and save")
+    def take_pictures(self, trigger_time=None):
         """Capture moth pictures with the camera.
         Optionally, the lamp can be switched off during capture.
         Pictures can be discarded during power save mode, during
         daytime or during bad weather conditions.
+
+        Captures of the event trigger pass the (monotonic) trigger time;
+        regular captures are skipped shortly after a triggered one.
         """
+        if trigger_time is None and self.trigger.recently_triggered():
+            logging.info("Skipping capture, just captured on a trigger.")
+            return
         # switch off lamp if needed
         if not config.lamp_during_capture:
             self.set_relais("off")
         # capture
-        picture_path = self.camera.capture()
-        if picture_path and self.valid_capture_conditions:
+        captures = self.bus.call(
+            "camera",
+            "capture",
+            self._capture,
+            trigger_time,
+            priority=PRIORITY_CAPTURE,
+        )
+        if captures:
+            self.trigger.note_capture(trigger_time)
+            if trigger_time is not None:
+                metrics.counter("triggered_captures_total", "Triggered captures").inc()
+        self.energy.add_captures(len(captures or []))
+        if captures and self.valid_capture_conditions:
             timestr = datetime.datetime.now().strftime("%d.%m. %H:%M:%S")
             self.status_dict["last_picture"] = timestr
-            target = Path(config.pictures_save_folder) / (timestr + ".jpg")
-            self.camera.save(picture_path, target)
+            self.status_dict["last_picture_time"] = time.time()
+            if config.upload_copy:
+                save_folder = postprocess.get_originals_folder(
+                    config.pictures_save_folder
+                )
+            else:
+                save_folder = config.pictures_save_folder
+            saved = self.bus.call(
+                "camera",
+                "save",
+                self.camera.save,
+                captures,
+                save_folder,
+                timestr,
+                priority=PRIORITY_DOWNLOAD,
+            )
+            saved = saved or []
+            paths = [path for capture, path in saved]
+            records = [self.get_manifest_record(capture) for capture, path in saved]
+            if config.upload_copy and saved:
+                futures = postprocess.submit_upload_copies(
+                    paths,
+                    config.pictures_save_folder,
+                    roi=config.upload_roi,
+                    quality=config.upload_quality,
+                )
+                # the manifest describes the uploaded copies
+                for future, record in zip(futures, records):
+
+                    def add_copy(future, record=record):
+                        if not future.exception():
+                            self.add_to_manifest(future.result(), record)
+
+                    future.add_done_callback(add_copy)
+            else:
+                for path, record in zip(paths, records):
+                    self.add_to_manifest(path, record)
         # turn lamp back on if needed
         if not config.lamp_during_capture:
             self.set_relais("on")
 
+    def _capture(self, trigger_time=None):
+        captures = self.camera.capture()
+        # including the queue, the worker round trip and the camera
+        if trigger_time is not None and captures:
+            metrics.histogram(
+                "trigger_latency_seconds", "Time from trigger to capture"
+            ).observe(time.monotonic() - trigger_time)
+        return captures
+
     def refresh_camera(self):
         """Re-connect to the camera, avoiding automatic standby."""
-        self.camera.reconnect()
+        self.bus.call(
+            "camera",
+            "reconnect",
+            self.camera.reconnect,
+            priority=PRIORITY_BUTTON,
+            coalesce=True,
+        )
+
+    def request_camera_reconnect(self):
+        """Queue a camera reconnect (e.g., on button press) without waiting."""
+        self.bus.submit(
+            "camera",
+            "reconnect",
+            self.camera.reconnect,
+            priority=PRIORITY_BUTTON,
+            coalesce=True,
+        )
+
+    def check_camera_health(self):
+        """Probe the cameras, reconnect in the background if necessary.
+
+        Healthy cameras are refreshed every cam_reconnect_interval.
+        """
+        self.bus.call(
+            "camera",
+            "check_health",
+            self.camera.check_health,
+            refresh_interval=config.cam_reconnect_interval,
+            priority=PRIORITY_MAINTENANCE,
+            coalesce=True,
+        )
+        self.status_dict["camera"] = self.camera.is_available
+        self.status_dict["cameras"] = self.camera.availability()
+        self.status_dict["camera_health"] = self.camera.health()
+
+    @property
+    def epaper_available(self):
+        """True if the display was found (known after start_up())."""
+        return Epaper.is_available
+
+    @property
+    def energy_lamp_off(self):
+        """The lamp is off to fit the energy budget (captures continue)."""
+        return self.energy_plan.get("lamp_off", False)
 
     @property
     def power_save_mode(self):
         """Power save mode, depending on daylight and weather."""
         if config.power_save_daylight and is_sunshine(lat=config.lat, lon=config.lon):
             return True
-        if config.power_save_weather and Weather.safe_for_moths_weather():
+        if config.power_save_weather and not self.weather.safe_for_moths_weather():
             return True
         return False
 
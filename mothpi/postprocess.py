@@ -0,0 +1,136 @@
+# !/usr/bin/python3
+# -*- coding:utf-8 -*-
+
+"""
+Post-capture processing of pictures for Mothpi.
+
+Creates a compact upload copy of each picture: cropped to the region
+of interest (the sheet) and re-encoded at a configurable JPEG quality.
+The processing runs in a process pool, off the capture thread.
+
+The originals are kept in a subfolder of the pictures folder that is
+not uploaded (the uploader skips subfolders); the oldest originals are
+deleted when disk space is needed.
+
+2021, Technische Universität München, Ludwig Kürzinger
+"""
+
+import logging
+import multiprocessing
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from mothpi.logbuffer import setup_process_logging
+from mothpi.metrics import metrics
+
+ORIGINALS_FOLDER_NAME = "originals"
+
+_pool = None
+
+
+def get_originals_folder(pictures_folder):
+    """Return the folder for originals (created if needed)."""
+    folder = Path(pictures_folder) / ORIGINALS_FOLDER_NAME
+    folder.mkdir(parents=True, exist_ok=True)
+    return folder
+
+
+def make_upload_copy(source, target, roi=(0.0, 0.0, 1.0, 1.0), quality=80):
+    """Crop a picture to the region of interest and re-encode it.
+
+    roi is given as relative (left, top, right, bottom) coordinates.
+    EXIF data and the modification time are kept.
+    """
+    from PIL import Image
+
+    with Image.open(source) as image:
+        width, height = image.size
+        left, top, right, bottom = roi
+        box = (
+            int(left * width),
+            int(top * height),
+            int(right * width),
+            int(bottom * height),
+        )
+        if box != (0, 0, width, height):
+            cropped = image.crop(box)
+        else:
+            cropped = image
+        # write next to the original (not uploaded, as the uploader skips
+        # subfolders) and move it into place once it is complete
+        temporary = Path(source).with_name(Path(target).name + ".part")
+        cropped.save(
+            temporary,
+            "JPEG",
+            quality=quality,
+            optimize=True,
+            exif=image.info.get("exif", b""),
+        )
+    stat = os.stat(source)
+    os.utime(temporary, (stat.st_atime, stat.st_mtime))
+    os.replace(temporary, target)
+    return str(target)
+
+
+def _done(future):
+    if future.exception():
+        logging.error(f"Creating the upload copy failed: {future.exception()!r}")
+    else:
+        metrics.counter("upload_copies_total").inc()
+
+
+def submit_upload_copies(originals, pictures_folder, roi, quality):
+    """Queue the creation of upload copies; returns immediately.
+
+    The copies are saved with the same name in the pictures folder.
+    """
+    global _pool
+    if _pool is None:
+        # started from a fork server, not forked from the multithreaded daemon
+        _pool = ProcessPoolExecutor(
+            max_workers=2,
+            mp_context=multiprocessing.get_context("forkserver"),
+            initializer=setup_process_logging,
+            initargs=(logging.getLogger().getEffectiveLevel(),),
+        )
+    futures = []
+    for original in originals:
+        target = Path(pictures_folder) / Path(original).name
+        future = _pool.submit(
+            make_upload_copy, str(original), str(target), roi, quality
+        )
+        future.add_done_callback(_done)
+        futures.append(future)
+    return futures
+
+
+def shutdown():
+    """Wait for pending upload copies and stop the process pool."""
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=True)
+        _pool = None
+
+
+def prune_originals(pictures_folder, min_free_bytes):
+    """Delete the oldest originals until min_free_bytes are available.
+
+    Returns the number of deleted files.
+    """
+    folder = Path(pictures_folder) / ORIGINALS_FOLDER_NAME
+    if not folder.is_dir():
+        return 0
+    free = shutil.disk_usage(pictures_folder).free
+    if free >= min_free_bytes:
+        return 0
+    deleted = 0
+    for original in sorted(folder.glob("*.jpg"), key=lambda p: p.stat().st_mtime):
+        if free >= min_free_bytes:
+            break
+        free += original.stat().st_size
+        original.unlink()
+        deleted += 1
+    logging.info(f"Deleted {deleted} original pictures to free disk space.")
+    return deleted
@@ -8,6 +8,10 @@ The relais module is centrally controlled in this unit.
 All control functions are available as staticmethods and thus
 only need to be imported, and don't need to be initialized.
 
+State changes are applied as a whole with Relais.apply(): only channels
+whose pin state actually changes are written, and every switching
+event is recorded in a timestamped log.
+
 2021, Technische Universität München, Ludwig Kürzinger
 """
 
@@ -19,14 +23,22 @@ only need to be imported, and don't need to be initialized.
 # 			P21 ----> Relay_Ch3
 
 ##################################################
+import datetime
 import logging
+from collections import deque
+from threading import Lock
+
+from mothpi.simulation import SIMULATE
 
 Relay_Ch1 = 26
 Relay_Ch2 = 20
 Relay_Ch3 = 21
 
 try:
-    import RPi.GPIO as GPIO
+    if SIMULATE:
+        from mothpi.simulation import GPIO
+    else:
+        import RPi.GPIO as GPIO
 
     GPIO.setwarnings(False)
     GPIO.setmode(GPIO.BCM)
@@ -53,32 +65,80 @@ relais_states = {
 }
 
 
+# (timestamp, channel, state) of the latest switching events
+switching_log = deque(maxlen=1000)
+_relais_lock = Lock()
+
+
 class Relais:
     @staticmethod
     def cleanup():
-        GPIO.cleanup()
         Relais.reset()
+        if GPIO_IS_AVAILABLE:
+            GPIO.cleanup()
+
+    @staticmethod
+    def read_state():
+        """Read back the actual state of all channels {channel: is_on}.
+
+        The relais are active low. Without GPIO, the stored state is returned.
+        """
+        if not GPIO_IS_AVAILABLE:
+            return dict(relais_states)
+        return {
+            channel: GPIO.input(pin) == GPIO.LOW
+            for channel, pin in relais_channels.items()
+        }
+
+    @staticmethod
+    def apply(desired_states: dict):
+        """Apply a set of channel states {channel: is_on} at once.
+
+        Only channels whose actual state differs are written.
+        Returns a dict of the changed channels.
+        """
+        for channel in desired_states:
+            if channel not in relais_channels.keys():
+                raise ValueError(f"channel has to be in {relais_channels.keys()}")
+        with _relais_lock:
+            actual_states = Relais.read_state()
+            changed = {
+                channel: bool(state)
+                for channel, state in desired_states.items()
+                if actual_states[channel] != bool(state)
+            }
+            now = datetime.datetime.now()
+            for channel, state in changed.items():
+                if GPIO_IS_AVAILABLE:
+                    level = GPIO.LOW if state else GPIO.HIGH
+                    GPIO.output(relais_channels[channel], level)
+                relais_states[channel] = state
+                switching_log.append((now, channel, state))
+            # keep the stored state in sync with the pins
+            relais_states.update(actual_states)
+            relais_states.update(changed)
+        if changed:
+            logging.debug(f"Relais switched: {changed}")
+        return changed
 
     @staticmethod
     def set_on(channel):
-        if channel not in relais_channels.keys():
-            raise ValueError(f"channel has to be in {relais_channels.keys()}")
-        if GPIO_IS_AVAILABLE:
-            GPIO.output(relais_channels[channel], GPIO.LOW)
-        relais_states[channel] = True
-        logging.info(f"Channel {channel} ON!")
+        Relais.apply({channel: True})
 
     @staticmethod
     def set_off(channel):
-        if channel not in relais_channels.keys():
-            raise ValueError(f"channel has to be in {relais_channels.keys()}")
-        if GPIO_IS_AVAILABLE:
-            GPIO.output(relais_channels[channel], GPIO.HIGH)
-        relais_states[channel] = False
-        logging.info(f"Channel {channel} OFF!")
+        Relais.apply({channel: False})
 
     @staticmethod
     def reset():
-        relais_states[1] = False
-        relais_states[2] = False
-        relais_states[3] = False
+        """Switch all channels off."""
+        Relais.apply({channel: False for channel in relais_channels})
+
+    @staticmethod
+    def get_switching_log(since=None):
+        """Return the switching events [(timestamp, channel, state)]."""
+        with _relais_lock:
+            events = list(switching_log)
+        if since:
+            events = [event for event in events if event[0] >= since]
+        return events
@@ -0,0 +1,298 @@
+# !/usr/bin/python3
+# -*- coding:utf-8 -*-
+
+"""
+Mothpi schedule simulator.
+
+Replays the power save and capture decisions of Mothpi over a whole year
+for given coordinates and, optionally, a recorded weather file, and
+reports the expected lamp-on hours, number of pictures, storage and
+upload volume per night:
+
+    python3 -m mothpi.schedule --lat 48.151 --lon 11.568 --year 2022 \
+        --weather weather_2022.json --output schedule.csv
+
+Weather files are either Brightsky API responses (JSON, as retrieved by
+mothpi/weather.py) or CSV files with the columns timestamp, wind_speed
+and temperature. Without weather data, the weather is assumed to be good.
+
+--
+2021, Technische Universität München, Ludwig Kürzinger
+"""
+
+import argparse
+import csv
+import datetime
+import json
+from pathlib import Path
+
+import numpy as np
+from suntime import Sun, SunTimeException
+
+from mothpi.config import config
+from mothpi.weather import is_safe_for_moths, is_sunshine
+
+SECONDS_PER_DAY = 24 * 60 * 60
+
+# Sites for --check: Munich, San Francisco (sunset after 00:00 UTC) and
+# Sydney (sunrise before 00:00 UTC)
+CHECK_SITES = [(48.151, 11.568), (37.7, -122.4), (-33.9, 151.2)]
+
+
+def get_parser():
+    """Obtain an argument-parser for the script interface."""
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("--lat", type=float, default=config.lat)
+    parser.add_argument("--lon", type=float, default=config.lon)
+    parser.add_argument(
+        "--year", type=int, default=datetime.date.today().year, help="Simulated year"
+    )
+    parser.add_argument(
+        "--capture_interval",
+        type=int,
+        default=config.capture_interval,
+        help="Capture interval (s)",
+    )
+    parser.add_argument(
+        "--power_save_daylight",
+        action=argparse.BooleanOptionalAction,
+        default=config.power_save_daylight,
+        help="Deactivate the lamp during daytime",
+    )
+    parser.add_argument(
+        "--power_save_weather",
+        action=argparse.BooleanOptionalAction,
+        default=config.power_save_weather,
+        help="Only capture at good weather conditions",
+    )
+    parser.add_argument("--weather", type=Path, help="Recorded weather file")
+    parser.add_argument("--cameras", type=int, default=1, help="Number of cameras")
+    parser.add_argument(
+        "--picture_mb", type=float, default=5.0, help="Size of a picture (MB)"
+    )
+    parser.add_argument(
+        "--status_kb", type=float, default=5.0, help="Size of a status image (kB)"
+    )
+    parser.add_argument(
+        "--upload_interval",
+        type=int,
+        default=30 * 60,
+        help="Interval of the uploader, each uploads a status image (s)",
+    )
+    parser.add_argument("--output", type=Path, help="Write nights to a CSV file")
+    parser.add_argument(
+        "--check",
+        action="store_true",
+        help="Compare the simulated daylight to is_sunshine() and exit",
+    )
+    return parser
+
+
+def load_weather(path: Path):
+    """Load recorded weather data.
+
+    Returns arrays of timestamps (s), wind speed and temperature,
+    sorted by time.
+    """
+    if path.suffix == ".json":
+        with open(path, "r") as f:
+            records = json.load(f)["weather"]
+    else:
+        with open(path, "r", newline="") as f:
+            records = list(csv.DictReader(f))
+    records = [
+        r
+        for r in records
+        if r["wind_speed"] not in (None, "") and r["temperature"] not in (None, "")
+    ]
+    timestamps = np.array(
+        [datetime.datetime.fromisoformat(r["timestamp"]).timestamp() for r in records]
+    )
+    wind_speed = np.array([float(r["wind_speed"]) for r in records])
+    temperature = np.array([float(r["temperature"]) for r in records])
+    order = np.argsort(timestamps)
+    return timestamps[order], wind_speed[order], temperature[order]
+
+
+def get_sun_times(lat, lon, first_day: datetime.date, num_days):
+    """Return arrays of sunrise and sunset timestamps (s) for each day.
+
+    Days without sunrise or sunset (polar regions) are treated as night.
+    """
+    sun = Sun(lat, lon)
+    sunrise = np.zeros(num_days)
+    sunset = np.zeros(num_days)
+    for i in range(num_days):
+        day = first_day + datetime.timedelta(days=i)
+        try:
+            sunrise[i] = sun.get_sunrise_time(day).timestamp()
+            sunset[i] = sun.get_sunset_time(day).timestamp()
+        except SunTimeException:
+            pass
+    return sunrise, sunset
+
+
+def is_daylight(lat, lon, timestamps, first_day: datetime.date, num_days):
+    """Vectorized is_sunshine() for timestamps (s) within num_days from first_day.
+
+    As in is_sunshine(), the days before and after each UTC date are
+    checked, since the sunset can fall on the next UTC date.
+    """
+    sunrise, sunset = get_sun_times(
+        lat, lon, first_day - datetime.timedelta(days=1), num_days + 2
+    )
+    start = datetime.datetime.combine(
+        first_day, datetime.time(), datetime.timezone.utc
+    ).timestamp()
+    day = ((timestamps - start) // SECONDS_PER_DAY).astype(int)
+    daylight = np.zeros(len(timestamps), dtype=bool)
+    for i in (0, 1, 2):
+        daylight |= (sunrise[day + i] < timestamps) & (timestamps < sunset[day + i])
+    return daylight
+
+
+def check_daylight(sites=CHECK_SITES, year=2022, num_samples=2000):
+    """Compare is_daylight() to is_sunshine() at random times of a year.
+
+    Returns a list of mismatches as (lat, lon, UTC time).
+    """
+    first_day = datetime.date(year, 1, 1)
+    num_days = (datetime.date(year + 1, 1, 1) - first_day).days
+    start = datetime.datetime(year, 1, 1, tzinfo=datetime.timezone.utc).timestamp()
+    rng = np.random.default_rng(year)
+    timestamps = start + rng.integers(0, num_days * SECONDS_PER_DAY, num_samples)
+    mismatches = []
+    for lat, lon in sites:
+        daylight = is_daylight(lat, lon, timestamps, first_day, num_days)
+        for timestamp, expected in zip(timestamps, daylight):
+            at_time = datetime.datetime.fromtimestamp(
+                int(timestamp), datetime.timezone.utc
+            )
+            if is_sunshine(lat, lon, at_time) != expected:
+                mismatches.append((lat, lon, at_time))
+    return mismatches
+
+
+def simulate_schedule(
+    lat,
+    lon,
+    year,
+    capture_interval,
+    power_save_daylight=True,
+    power_save_weather=False,
+    weather=None,
+):
+    """Evaluate the power save mode for each capture of a year at once.
+
+    This mirrors MothPi.power_save_mode and valid_capture_conditions
+    (without the disk check). Returns a dict of arrays per capture tick:
+    timestamp, night (day of year of the evening), power_save.
+    """
+    first_day = datetime.date(year, 1, 1)
+    num_days = (datetime.date(year + 1, 1, 1) - first_day).days
+    start = datetime.datetime(year, 1, 1, tzinfo=datetime.timezone.utc).timestamp()
+    timestamps = np.arange(start, start + num_days * SECONDS_PER_DAY, capture_interval)
+    power_save = np.zeros(len(timestamps), dtype=bool)
+    if power_save_daylight:
+        power_save |= is_daylight(lat, lon, timestamps, first_day, num_days)
+    if power_save_weather and weather is not None:
+        weather_timestamps, wind_speed, temperature = weather
+        # latest weather record before each capture
+        index = np.searchsorted(weather_timestamps, timestamps, side="right") - 1
+        known = index >= 0
+        index = np.clip(index, 0, None)
+        safe = is_safe_for_moths(wind_speed[index], temperature[index])
+        power_save |= known & ~safe
+    # a night belongs to the date of the evening (in local solar time)
+    solar_time = timestamps + lon / 360 * SECONDS_PER_DAY
+    night = np.floor((solar_time - start) / SECONDS_PER_DAY - 0.5).astype(int)
+    return {"timestamp": timestamps, "night": night, "power_save": power_save}
+
+
+def summarize_nights(
+    schedule,
+    capture_interval,
+    year,
+    cameras=1,
+    picture_mb=5.0,
+    status_kb=5.0,
+    upload_interval=30 * 60,
+):
+    """Aggregate the schedule per night.
+
+    Returns a list of dicts with date, lamp-on hours, pictures,
+    storage (MB) and upload volume (MB).
+    """
+    night = schedule["night"]
+    offset = -night.min()
+    active = ~schedule["power_save"]
+    ticks = np.bincount(night + offset, weights=active)
+    lamp_hours = ticks * capture_interval / 3600
+    pictures = ticks * cameras
+    storage_mb = pictures * picture_mb
+    uploads = SECONDS_PER_DAY / upload_interval
+    upload_mb = storage_mb + uploads * status_kb / 1000
+    first_day = datetime.date(year, 1, 1)
+    return [
+        {
+            "night": str(first_day + datetime.timedelta(days=int(i - offset))),
+            "lamp_on_hours": round(lamp_hours[i], 2),
+            "pictures": int(pictures[i]),
+            "storage_mb": round(storage_mb[i], 1),
+            "upload_mb": round(upload_mb[i], 1),
+        }
+        for i in range(len(ticks))
+    ]
+
+
+def main():
+    """Simulate a year and print a summary per night."""
+    args = get_parser().parse_args()
+    if args.check:
+        sites = CHECK_SITES + [(args.lat, args.lon)]
+        mismatches = check_daylight(sites, args.year)
+        for lat, lon, at_time in mismatches:
+            print(f"Daylight differs at {lat}, {lon} at {at_time}")
+        if mismatches:
+            raise SystemExit(1)
+        print("Simulated daylight matches is_sunshine().")
+        return
+    weather = load_weather(args.weather) if args.weather else None
+    if args.power_save_weather and weather is None:
+        print("No weather file given, assuming good weather.")
+    schedule = simulate_schedule(
+        args.lat,
+        args.lon,
+        args.year,
+        args.capture_interval,
+        power_save_daylight=args.power_save_daylight,
+        power_save_weather=args.power_save_weather,
+        weather=weather,
+    )
+    nights = summarize_nights(
+        schedule,
+        args.capture_interval,
+        args.year,
+        cameras=args.cameras,
+        picture_mb=args.picture_mb,
+        status_kb=args.status_kb,
+        upload_interval=args.upload_interval,
+    )
+    keys = list(nights[0].keys())
+    print(" ".join(f"{key:>14}" for key in keys))
+    for item in nights:
+        print(" ".join(f"{str(item[key]):>14}" for key in keys))
+    totals = {key: sum(item[key] for item in nights) for key in keys[1:]}
+    print("Total: " + ", ".join(f"{key}={value:.1f}" for key, value in totals.items()))
+    if args.output:
+        with open(args.output, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=keys)
+            writer.writeheader()
+            writer.writerows(nights)
+
+
+if __name__ == "__main__":
+    main()
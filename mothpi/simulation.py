@@ -0,0 +1,353 @@
+# !/usr/bin/python3
+# -*- coding:utf-8 -*-
+
+"""
+Simulated hardware backends for Mothpi.
+
+Stand-ins for gphoto2, RPi.GPIO, the waveshare e-paper and gpiozero
+buttons and inputs, so that Mothpi runs on a normal Linux computer, e.g., for
+benchmarks (see mothpi/benchmark.py). Activated by setting the
+environment variable MOTHPI_SIMULATE=1 before mothpi is imported.
+
+The behaviour of the simulated devices is set in ``simulation``,
+e.g., the number of cameras, picture size and latencies.
+
+2021, Technische Universität München, Ludwig Kürzinger
+"""
+
+import io
+import os
+import random
+import time
+from types import SimpleNamespace
+
+SIMULATE = bool(os.environ.get("MOTHPI_SIMULATE"))
+
+simulation = SimpleNamespace(
+    num_cameras=1,
+    # picture size in pixels, and JPEG quality
+    picture_size=(6000, 4000),
+    picture_quality=90,
+    capture_latency=0.5,
+    download_latency_per_mb=0.1,
+    # probability that a camera call fails
+    failure_rate=0.0,
+    # camera clock minus system clock (s)
+    camera_clock_offset=0,
+    display_latency=0.0,
+)
+
+
+def _sleep(seconds):
+    if seconds > 0:
+        time.sleep(seconds)
+
+
+##################################################
+# gphoto2
+
+
+class _Gphoto2:
+    """Minimal subset of the python-gphoto2 interface used by Mothpi."""
+
+    class GPhoto2Error(Exception):
+        pass
+
+    GP_CAPTURE_IMAGE = 0
+    GP_FILE_TYPE_NORMAL = 1
+    GP_WIDGET_TEXT = 2
+    GP_WIDGET_RANGE = 3
+    GP_WIDGET_TOGGLE = 4
+    GP_WIDGET_RADIO = 5
+    GP_WIDGET_MENU = 6
+    GP_WIDGET_DATE = 8
+
+    def __init__(self):
+        gp = self
+        _jpeg_cache = {}
+
+        def maybe_fail(call):
+            if random.random() < simulation.failure_rate:
+                raise gp.GPhoto2Error(f"[-7] I/O problem (simulated, {call})")
+
+        def get_jpeg():
+            key = (simulation.picture_size, simulation.picture_quality)
+            if key not in _jpeg_cache:
+                from PIL import Image
+
+                # noise does not compress, similar in size to real pictures
+                width, height = simulation.picture_size
+                image = Image.frombytes(
+                    "RGB", (width, height), os.urandom(width * height * 3)
+                )
+                buffer = io.BytesIO()
+                image.save(buffer, "JPEG", quality=simulation.picture_quality)
+                _jpeg_cache[key] = buffer.getvalue()
+            return _jpeg_cache[key]
+
+        class CameraWidget:
+            def __init__(self, name, widget_type, value=None, choices=()):
+                self.name = name
+                self.type = widget_type
+                self.value = value
+                self.choices = list(choices)
+                self.children = {}
+
+            def get_name(self):
+                return self.name
+
+            def get_type(self):
+                return self.type
+
+            def get_value(self):
+                if self.type == gp.GP_WIDGET_DATE:
+                    return int(time.time() + simulation.camera_clock_offset)
+                return self.value
+
+            def set_value(self, value):
+                self.value = value
+
+            def get_choices(self):
+                return iter(self.choices)
+
+            def get_child_by_name(self, name):
+                if name not in self.children:
+                    raise gp.GPhoto2Error(f"[-2] Bad parameters ({name})")
+                return self.children[name]
+
+        class CameraFilePath:
+            def __init__(self, folder, name):
+                self.folder = folder
+                self.name = name
+
+        class CameraFile:
+            def __init__(self, data, mtime):
+                self.data = data
+                self.mtime = mtime
+
+            def save(self, target):
+                with open(target, "wb") as f:
+                    f.write(self.data)
+
+        class Camera:
+            def __init__(self):
+                self.port_index = 0
+                self.initialized = False
+                self.counter = 0
+                self.files = {}
+                self.config = CameraWidget("main", 0)
+                for name, widget_type, value, choices in [
+                    ("iso", gp.GP_WIDGET_RADIO, "100", ["100", "400", "1600"]),
+                    ("shutterspeed", gp.GP_WIDGET_RADIO, "1/60", ["1/60", "1/125"]),
+                    ("flashmode", gp.GP_WIDGET_RADIO, "Fill flash", ["Fill flash"]),
+                    ("capturetarget", gp.GP_WIDGET_RADIO, "Memory card", ["SDRAM"]),
+                    ("datetime", gp.GP_WIDGET_DATE, None, ()),
+                ]:
+                    self.config.children[name] = CameraWidget(
+                        name, widget_type, value, choices
+                    )
+
+            @staticmethod
+            def autodetect():
+                return [
+                    ("Simulated Camera", f"usb:001,{i + 2:03d}")
+                    for i in range(simulation.num_cameras)
+                ]
+
+            def set_port_info(self, port_info):
+                self.port_index = port_info
+
+            def set_abilities(self, abilities):
+                pass
+
+            def _check(self, call):
+                if not self.initialized:
+                    raise gp.GPhoto2Error("[-105] Unknown model (simulated)")
+                maybe_fail(call)
+
+            def init(self):
+                if self.port_index >= simulation.num_cameras:
+                    raise gp.GPhoto2Error("[-105] Unknown model (simulated)")
+                self.initialized = True
+
+            def exit(self):
+                self.initialized = False
+
+            def get_summary(self):
+                return f"Simulated camera on port {self.port_index}"
+
+            def get_storageinfo(self):
+                self._check("get_storageinfo")
+                return []
+
+            def capture(self, capture_type=0):
+                self._check("capture")
+                _sleep(simulation.capture_latency)
+                self.counter += 1
+                path = CameraFilePath(
+                    "/store_00010001/DCIM/100MSDCF", f"DSC{self.counter:05d}.JPG"
+                )
+                mtime = int(time.time() + simulation.camera_clock_offset)
+                self.files[(path.folder, path.name)] = CameraFile(get_jpeg(), mtime)
+                return path
+
+            def file_get(self, folder, name, file_type):
+                self._check("file_get")
+                camera_file = self.files.pop((folder, name))
+                megabytes = len(camera_file.data) / 1e6
+                _sleep(megabytes * simulation.download_latency_per_mb)
+                return camera_file
+
+            def file_get_info(self, folder, name):
+                self._check("file_get_info")
+                mtime = self.files[(folder, name)].mtime
+                return SimpleNamespace(file=SimpleNamespace(mtime=mtime))
+
+            def folder_list_files(self, path):
+                return [(name, None) for folder, name in self.files if folder == path]
+
+            def folder_list_folders(self, path):
+                return []
+
+            def get_config(self):
+                self._check("get_config")
+                return self.config
+
+            def set_config(self, config):
+                self._check("set_config")
+
+            def get_single_config(self, name):
+                self._check("get_single_config")
+                return self.config.get_child_by_name(name)
+
+            def set_single_config(self, name, widget):
+                self._check("set_single_config")
+                simulation.camera_clock_offset = widget.value - time.time()
+
+        class PortInfoList(list):
+            def load(self):
+                self[:] = [f"usb:001,{i + 2:03d}" for i in range(8)]
+
+            def lookup_path(self, path):
+                return self.index(path)
+
+            def __getitem__(self, index):
+                return index
+
+        class CameraAbilitiesList(list):
+            def load(self):
+                pass
+
+            def lookup_model(self, model):
+                return 0
+
+            def __getitem__(self, index):
+                return index
+
+        self.Camera = Camera
+        self.CameraWidget = CameraWidget
+        self.CameraFilePath = CameraFilePath
+        self.PortInfoList = PortInfoList
+        self.CameraAbilitiesList = CameraAbilitiesList
+
+
+gphoto2 = _Gphoto2()
+
+
+##################################################
+# RPi.GPIO
+
+
+class _GPIO:
+    """In-memory GPIO with a counter of pin writes."""
+
+    BCM = "BCM"
+    OUT = "OUT"
+    IN = "IN"
+    LOW = 0
+    HIGH = 1
+
+    def __init__(self):
+        self.pins = {}
+        self.writes = 0
+
+    def setwarnings(self, flag):
+        pass
+
+    def setmode(self, mode):
+        pass
+
+    def setup(self, pin, direction):
+        self.pins[pin] = self.LOW
+
+    def output(self, pin, level):
+        self.writes += 1
+        self.pins[pin] = level
+
+    def input(self, pin):
+        return self.pins.get(pin, self.LOW)
+
+    def cleanup(self):
+        self.pins.clear()
+
+
+GPIO = _GPIO()
+
+
+##################################################
+# waveshare e-paper and gpiozero buttons
+
+
+class _EPD:
+    """Framebuffer e-paper, keeps the last frame and counts refreshes."""
+
+    def __init__(self):
+        self.frame = None
+        self.refreshes = 0
+
+    def init(self):
+        pass
+
+    def Clear(self, color):
+        self.frame = None
+
+    def getbuffer(self, image):
+        return image.tobytes()
+
+    def display(self, buffer):
+        _sleep(simulation.display_latency)
+        self.frame = buffer
+        self.refreshes += 1
+
+
+epd2in7 = SimpleNamespace(EPD=_EPD)
+
+
+class Button:
+    """gpiozero-like button; press() calls the handler."""
+
+    def __init__(self, pin):
+        self.pin = SimpleNamespace(number=pin)
+        self.when_pressed = None
+
+    def press(self):
+        if self.when_pressed:
+            self.when_pressed()
+
+
+class DigitalInputDevice:
+    """gpiozero-like input, e.g., a PIR sensor; activate() calls the handler."""
+
+    def __init__(self, pin, pull_up=False, bounce_time=None):
+        self.pin = SimpleNamespace(number=pin)
+        self.pull_up = pull_up
+        self.bounce_time = bounce_time
+        self.when_activated = None
+        self.closed = False
+
+    def activate(self):
+        if self.when_activated and not self.closed:
+            self.when_activated()
+
+    def close(self):
+        self.closed = True
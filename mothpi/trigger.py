@@ -0,0 +1,146 @@
+# !/usr/bin/python3
+# -*- coding:utf-8 -*-
+
+"""
+Event trigger for Mothpi.
+
+An external sensor (e.g., a PIR sensor or a light barrier) on a free GPIO
+triggers an immediate capture in addition to the regular timer. Triggers
+are debounced, and limited by a minimum spacing to the last capture and
+by a budget of triggered captures per hour.
+
+2021, Technische Universität München, Ludwig Kürzinger
+"""
+
+import logging
+import time
+from collections import deque
+from threading import Lock
+
+from mothpi.metrics import metrics
+from mothpi.simulation import SIMULATE
+
+# Pins already used by the e-paper buttons, the e-paper (SPI and control)
+# and the relais board (BCM)
+RESERVED_PINS = {5, 6, 8, 9, 10, 11, 13, 17, 19, 20, 21, 24, 25, 26}
+
+
+class EventTrigger:
+    """GPIO input that calls a handler with the trigger time.
+
+    The input device is set up with init(), like the buttons in
+    mothpi/display.py; pin 0 disables the trigger.
+    """
+
+    def __init__(
+        self, pin=0, pull_up=False, debounce=0.2, min_spacing=15.0, max_per_hour=60
+    ):
+        self.pin = pin
+        self.pull_up = pull_up
+        self.debounce = debounce
+        self.min_spacing = min_spacing
+        self.max_per_hour = max_per_hour
+        self.device = None
+        self.handler = None
+        # monotonic times of the last signal, the last capture (of any
+        # source) and of the triggered captures within the last hour
+        self.last_signal = None
+        self.last_capture = None
+        self.accepted = deque()
+        # a triggered capture is queued or running
+        self.pending = False
+        self._lock = Lock()
+
+    @property
+    def is_enabled(self):
+        return bool(self.pin)
+
+    def init(self):
+        """Set up the input device; returns True if available."""
+        self.close()
+        if not self.is_enabled:
+            return False
+        try:
+            if SIMULATE:
+                from mothpi.simulation import DigitalInputDevice
+            else:
+                from gpiozero import DigitalInputDevice
+
+            self.device = DigitalInputDevice(
+                self.pin, pull_up=self.pull_up, bounce_time=self.debounce or None
+            )
+            self.device.when_activated = self.fire
+            logging.info(f"Event trigger on GPIO {self.pin}.")
+        except Exception:
+            logging.exception(f"Event trigger on GPIO {self.pin} not available!")
+            self.device = None
+        return self.device is not None
+
+    def set_handler(self, handler_fn):
+        """Set the handler, called as handler_fn(trigger_time).
+
+        The handler returns True if a capture was queued; it then has to
+        call note_capture() or release() when done.
+        """
+        self.handler = handler_fn
+
+    def note_capture(self, trigger_time=None):
+        """Record a capture of any source for the minimum spacing.
+
+        Triggered captures pass their trigger time; they count towards
+        the hourly budget.
+        """
+        with self._lock:
+            self.last_capture = time.monotonic()
+            if trigger_time is not None:
+                self.accepted.append(trigger_time)
+                self.pending = False
+
+    def release(self):
+        """End a pending trigger (captured or not)."""
+        with self._lock:
+            self.pending = False
+
+    def recently_captured(self, now=None):
+        """True if the last capture is less than min_spacing ago."""
+        now = now or time.monotonic()
+        last_capture = self.last_capture
+        return last_capture is not None and now - last_capture < self.min_spacing
+
+    def recently_triggered(self, now=None):
+        """True if the last accepted trigger is less than min_spacing ago."""
+        now = now or time.monotonic()
+        with self._lock:
+            return bool(self.accepted) and now - self.accepted[-1] < self.min_spacing
+
+    def allow(self, now):
+        """Check debounce, spacing and hourly budget for a signal at now."""
+        with self._lock:
+            last_signal, self.last_signal = self.last_signal, now
+            if last_signal is not None and now - last_signal < self.debounce:
+                return False
+            if self.pending or self.recently_captured(now):
+                metrics.counter("trigger_dropped_total", "Dropped triggers").inc()
+                return False
+            while self.accepted and now - self.accepted[0] > 3600:
+                self.accepted.popleft()
+            if len(self.accepted) >= self.max_per_hour:
+                metrics.counter("trigger_dropped_total", "Dropped triggers").inc()
+                return False
+            # the budget is used once the capture is done, see note_capture()
+            self.pending = True
+        return True
+
+    def fire(self):
+        """Handle a signal of the input device."""
+        now = time.monotonic()
+        metrics.counter("trigger_signals_total", "Signals of the trigger").inc()
+        if self.handler and self.allow(now):
+            logging.info("Event trigger: capture.")
+            if not self.handler(now):
+                self.release()
+
+    def close(self):
+        if self.device is not None:
+            self.device.close()
+            self.device = None
@@ -22,6 +22,9 @@ class Periodic(object):
     """
     A periodic task running in threading.Timers
     https://stackoverflow.com/questions/2398661/schedule-a-repeating-event-in-python-3
+
+    The time of the last successful execution is recorded, so that
+    a watchdog can detect jobs that hang or keep failing.
     """
 
     def __init__(self, interval, function, **kwargs):
@@ -31,25 +34,49 @@ class Periodic(object):
         self.interval = interval
         self.kwargs = kwargs
         self._stopped = True
+        self.last_success = time.monotonic()
         if kwargs.pop("autostart", True):
             self.start()
 
     def start(self, from_run=False):
         self._lock.acquire()
         if from_run or self._stopped:
+            if not from_run:
+                self.last_success = time.monotonic()
             self._stopped = False
             self._timer = Timer(self.interval, self._run)
             self._timer.start()
-            self._lock.release()
+        self._lock.release()
 
     def _run(self):
         self.start(from_run=True)
-        self.function(**self.kwargs)
+        try:
+            self.function(**self.kwargs)
+            self.last_success = time.monotonic()
+        except Exception:
+            logging.exception(f"Periodic {self.function.__name__} failed")
+
+    def reschedule(self, interval):
+        """Change the interval; a running timer is restarted with it."""
+        self._lock.acquire()
+        self.interval = interval
+        if not self._stopped:
+            self._timer.cancel()
+            self._timer = Timer(self.interval, self._run)
+            self._timer.start()
+        self._lock.release()
+
+    def is_stalled(self, threshold):
+        """True if the last success is more than interval + threshold ago."""
+        if self._stopped:
+            return False
+        return time.monotonic() - self.last_success > self.interval + threshold
 
     def stop(self):
         self._lock.acquire()
         self._stopped = True
-        self._timer.cancel()
+        if self._timer:
+            self._timer.cancel()
         self._lock.release()
 
 
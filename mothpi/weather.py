@@ -11,7 +11,9 @@ import logging
 import urllib.request
 import json
 import datetime
-from suntime import Sun
+from suntime import Sun, SunTimeException
+
+from mothpi.metrics import metrics
 
 
 class Weather:
@@ -37,6 +39,7 @@ class Weather:
         date_str = dt.strftime("%Y-%m-%d")
         return date_str
 
+    @metrics.timed("weather_fetch_seconds", "Time to retrieve weather data")
     def get_weather_dict(self, lat=48.151, lon=11.568, date=None):
         """Get weather information from API."""
         if not date:
@@ -71,11 +74,28 @@ class Weather:
 
         TODO: the values should be configurable
         """
-        if self.current_weather["wind_speed"] > wind_speed_max:
-            return False
-        if temperature_min <= self.current_weather["temperature"] <= temperature_max:
-            return False
-        return True
+        return is_safe_for_moths(
+            self.current_weather["wind_speed"],
+            self.current_weather["temperature"],
+            wind_speed_max=wind_speed_max,
+            temperature_min=temperature_min,
+            temperature_max=temperature_max,
+        )
+
+
+def is_safe_for_moths(
+    wind_speed,
+    temperature,
+    wind_speed_max=10,
+    temperature_min=-5.0,
+    temperature_max=50.0,
+):
+    """Weather condition for moths; works on numbers and on NumPy arrays."""
+    return (
+        (wind_speed <= wind_speed_max)
+        & (temperature_min <= temperature)
+        & (temperature <= temperature_max)
+    )
 
 
 def is_sunshine(lat=48.151, lon=11.568, at_time=None):
@@ -85,8 +105,39 @@ def is_sunshine(lat=48.151, lon=11.568, at_time=None):
     # Please assert correct time zone information
     assert at_time.tzinfo
     sun = Sun(lat, lon)
-    today_sun_rises_at = sun.get_local_sunrise_time(at_time)
-    today_sun_sets_at = sun.get_local_sunset_time(at_time)
-    if today_sun_rises_at < at_time < today_sun_sets_at:
-        return True
-    return False
+    return any(
+        sun_rises_at < at_time < sun_sets_at
+        for sun_rises_at, sun_sets_at in get_daylight_periods(sun, at_time)
+    )
+
+
+def get_daylight_periods(sun, at_time):
+    """Yield (sunrise, sunset) in UTC of the UTC dates around at_time.
+
+    The getters return the times of the day that starts on the UTC date;
+    west of Greenwich, its sunset falls on the following UTC date, so the
+    day before has to be checked as well (and the day after in the east).
+    The local getters return naive datetimes in some suntime versions.
+    """
+    date = at_time.astimezone(datetime.timezone.utc).date()
+    for days in (-1, 0, 1):
+        day = date + datetime.timedelta(days=days)
+        yield sun.get_sunrise_time(day), sun.get_sunset_time(day)
+
+
+def get_next_sunrise(lat=48.151, lon=11.568, at_time=None):
+    """Return the next sunrise after at_time (UTC), or None (polar regions)."""
+    if at_time is None:
+        at_time = datetime.datetime.now(datetime.timezone.utc)
+    assert at_time.tzinfo
+    sun = Sun(lat, lon)
+    date = at_time.astimezone(datetime.timezone.utc).date()
+    try:
+        # east of Greenwich, the sunrise of a UTC date can be on the date before
+        for days in (0, 1, 2):
+            sunrise = sun.get_sunrise_time(date + datetime.timedelta(days=days))
+            if sunrise > at_time:
+                return sunrise
+    except SunTimeException:
+        pass
+    return None